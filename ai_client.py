@@ -1,53 +1,663 @@
 # ai_client.py
 import os
-import requests
+import re
+import json
+import time
 import asyncio
+import hashlib
+import logging
+import httpx
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Awaitable, Callable
+from cachetools import TTLCache
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_random_exponential
 from dotenv import load_dotenv
 
+from metrics import Gauge, UPSTREAM_LATENCY
+from model_router import CircuitOpen, ModelRouter, Route, load_routes
+
 load_dotenv()
 
-client = None 
+logger = logging.getLogger(__name__)
+
+# One pooled async client per worker process (created in initialize_ai_client)
+client: httpx.AsyncClient | None = None
+
+GROQ_URL = os.getenv("GROQ_API_URL", "https://api.groq.com/openai/v1/chat/completions")
+GROQ_MODEL = "llama-3.3-70b-versatile"
+GROQ_TEMPERATURE = 0.7
+
+# Our context roles -> Groq/OpenAI roles (anything else is treated as "user")
+ROLE_MAP = {"ai": "assistant", "system": "system"}
+
+RAG_PROMPT = (
+    "Answer using the following excerpts from the user's knowledge base when they "
+    "are relevant. If they do not contain the answer, say so and answer from general "
+    "knowledge.\n\n{excerpts}"
+)
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a chat between a user and an AI assistant. "
+    "Merge the previous summary with the new messages into one concise summary "
+    "(at most {max_words} words). Keep names, facts, preferences, open questions "
+    "and decisions. Reply with the summary only."
+)
+
+# --- Connection Pool Configuration ---
+GROQ_MAX_CONNECTIONS = int(os.getenv("GROQ_MAX_CONNECTIONS", "100"))
+GROQ_MAX_KEEPALIVE = int(os.getenv("GROQ_MAX_KEEPALIVE", "20"))
+GROQ_KEEPALIVE_EXPIRY = float(os.getenv("GROQ_KEEPALIVE_EXPIRY", "30"))
+GROQ_CONNECT_TIMEOUT = float(os.getenv("GROQ_CONNECT_TIMEOUT", "5"))
+GROQ_READ_TIMEOUT = float(os.getenv("GROQ_READ_TIMEOUT", "15"))
+GROQ_POOL_TIMEOUT = float(os.getenv("GROQ_POOL_TIMEOUT", "10"))
+
+# --- Response Cache Configuration ---
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "600"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+
+# --- Admission Control Configuration ---
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv("UPSTREAM_MAX_CONCURRENCY", "16"))
+UPSTREAM_QUEUE_TIMEOUT = float(os.getenv("UPSTREAM_QUEUE_TIMEOUT", "10"))
+UPSTREAM_MAX_ATTEMPTS = int(os.getenv("UPSTREAM_MAX_ATTEMPTS", "3"))
+UPSTREAM_BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.5"))
+UPSTREAM_BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", "8"))
+UPSTREAM_RETRY_AFTER_MAX = float(os.getenv("UPSTREAM_RETRY_AFTER_MAX", "30"))
+
+def _http2_available() -> bool:
+    """HTTP/2 needs the optional 'h2' package; fall back to HTTP/1.1 keep-alive without it."""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
 
 async def initialize_ai_client():
-    """Confirms the Groq REST client is ready."""
+    """Creates the shared, pooled Groq HTTP client for this worker."""
+    global client
+    if client is None:
+        client = httpx.AsyncClient(
+            http2=_http2_available(),
+            limits=httpx.Limits(
+                max_connections=GROQ_MAX_CONNECTIONS,
+                max_keepalive_connections=GROQ_MAX_KEEPALIVE,
+                keepalive_expiry=GROQ_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(
+                connect=GROQ_CONNECT_TIMEOUT,
+                read=GROQ_READ_TIMEOUT,
+                write=GROQ_READ_TIMEOUT,
+                pool=GROQ_POOL_TIMEOUT,
+            ),
+        )
     print("✅ Groq AI Client ready.")
     return True
 
-async def get_ai_response(username: str, context_history: list[dict]) -> str:
-    api_key = os.getenv("GROQ_API_KEY")
-    if not api_key:
-        return "ERROR: Groq API Key missing."
+async def close_ai_client():
+    """Closes pooled connections on worker shutdown."""
+    global client
+    if client is not None:
+        await client.aclose()
+        client = None
+
+def _get_client() -> httpx.AsyncClient:
+    if client is None:
+        raise RuntimeError("AI client not initialized; call initialize_ai_client() on startup.")
+    return client
 
-    url = "https://api.groq.com/openai/v1/chat/completions"
-    
+def _build_request(context_history: list[dict], stream: bool = False,
+                   knowledge: list[str] | None = None) -> tuple[dict, dict]:
+    """Builds the Groq/OpenAI payload and headers from our context format."""
     # Map context to Groq/OpenAI format
     messages = []
+    if knowledge:
+        excerpts = "\n\n".join(f"[{i}] {chunk}" for i, chunk in enumerate(knowledge, 1))
+        messages.append({"role": "system", "content": RAG_PROMPT.format(excerpts=excerpts)})
     for m in context_history:
-        role = "assistant" if m["role"] == "ai" else "user"
+        role = ROLE_MAP.get(m["role"], "user")
         messages.append({"role": role, "content": m["content"]})
 
     payload = {
-        "model": "llama-3.3-70b-versatile",
+        "model": GROQ_MODEL,
         "messages": messages,
-        "temperature": 0.7
+        "temperature": GROQ_TEMPERATURE
     }
+    if stream:
+        payload["stream"] = True
 
     headers = {
-        "Authorization": f"Bearer {api_key}",
+        "Authorization": f"Bearer {os.getenv('GROQ_API_KEY')}",
         "Content-Type": "application/json"
     }
+    return payload, headers
 
+def _error_message(body: bytes) -> str:
     try:
-        response = await asyncio.to_thread(
-            requests.post, url, json=payload, headers=headers, timeout=15
-        )
-        data = response.json()
-        
-        if response.status_code == 200:
-            return data["choices"][0]["message"]["content"]
+        return json.loads(body).get("error", {}).get("message", "Unknown Groq Error")
+    except (ValueError, AttributeError):
+        return "Unknown Groq Error"
+
+class UpstreamError(Exception):
+    """Raised when Groq answers with a non-200 status."""
+
+    def __init__(self, message: str, status_code: int | None = None, retry_after: float | None = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+class QueueTimeout(Exception):
+    """Raised when a request waited longer than its deadline for an upstream slot."""
+
+class StreamInterrupted(Exception):
+    """Raised by stream_ai_response when it fails after some content was already yielded."""
+
+def _parse_retry_after(value: str | None) -> float | None:
+    """Retry-After is either delta-seconds or an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def _upstream_error(response: httpx.Response, body: bytes) -> UpstreamError:
+    return UpstreamError(
+        _error_message(body),
+        status_code=response.status_code,
+        retry_after=_parse_retry_after(response.headers.get("retry-after")),
+    )
+
+# --- Admission Control ---
+class UpstreamScheduler:
+    """Caps concurrent upstream calls per worker and admits waiters round-robin by user.
+
+    Each user has a FIFO queue; when a slot frees up it goes to the next user in
+    rotation, so one chatty user can't starve everyone else. A slot covers one
+    upstream attempt: retries give it up while they back off.
+    """
+
+    def __init__(self, max_concurrency: int = UPSTREAM_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self._active = 0
+        self._queues: OrderedDict[str, deque[asyncio.Future]] = OrderedDict()
+        self.admitted = 0
+        self.timed_out = 0
+        self.retries = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    @asynccontextmanager
+    async def slot(self, username: str, timeout: float = UPSTREAM_QUEUE_TIMEOUT):
+        await self.acquire(username, timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, username: str, timeout: float = UPSTREAM_QUEUE_TIMEOUT):
+        """Takes a slot (raising QueueTimeout after `timeout`); pair with release()."""
+        started = time.monotonic()
+        if self._active < self.max_concurrency and not self._queues:
+            self._active += 1
         else:
-            error_msg = data.get("error", {}).get("message", "Unknown Groq Error")
-            return f"AI Error: {error_msg}"
+            await self._wait(username, timeout)
+        waited = time.monotonic() - started
+        self.admitted += 1
+        self._total_wait += waited
+        self._max_wait = max(self._max_wait, waited)
+
+    def release(self):
+        self._release()
+
+    async def _wait(self, username: str, timeout: float):
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(username, deque()).append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # Granted a slot in the same tick we gave up; hand it on
+                self._release()
+            else:
+                self._discard(username, waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self.timed_out += 1
+                raise QueueTimeout(f"No upstream slot within {timeout:g}s") from None
+            raise
+
+    def _discard(self, username: str, waiter: asyncio.Future):
+        queue = self._queues.get(username)
+        if queue is not None:
+            try:
+                queue.remove(waiter)
+            except ValueError:
+                pass
+            if not queue:
+                del self._queues[username]
+
+    def _release(self):
+        self._active -= 1
+        while self._queues and self._active < self.max_concurrency:
+            username, queue = self._queues.popitem(last=False)
+            waiter = queue.popleft()
+            if queue:
+                # Back of the rotation
+                self._queues[username] = queue
+            if not waiter.done():
+                self._active += 1
+                waiter.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self._active,
+            "queue_depth": sum(len(q) for q in self._queues.values()),
+            "queued_users": len(self._queues),
+            "admitted": self.admitted,
+            "timed_out": self.timed_out,
+            "retries": self.retries,
+            "avg_wait_ms": round(self._total_wait / self.admitted * 1000, 2) if self.admitted else 0.0,
+            "max_wait_ms": round(self._max_wait * 1000, 2),
+        }
+
+scheduler = UpstreamScheduler()
+
+def get_scheduler_stats() -> dict:
+    return scheduler.stats()
+
+# --- Model Routing (hedging, fallback, circuit breaking) ---
+router = ModelRouter(load_routes(GROQ_URL, GROQ_MODEL))
+
+def get_router_stats() -> dict:
+    return router.stats()
+
+Gauge("upstream_in_flight", "Upstream calls holding a scheduler slot.", callback=lambda: scheduler._active)
+Gauge("upstream_queue_depth", "Requests waiting for an upstream slot.",
+      callback=lambda: sum(len(q) for q in scheduler._queues.values()))
+
+def _is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, UpstreamError):
+        return exc.status_code == 429 or (exc.status_code or 0) >= 500
+    return isinstance(exc, httpx.TransportError)
+
+_jittered_backoff = wait_random_exponential(multiplier=UPSTREAM_BACKOFF_BASE, max=UPSTREAM_BACKOFF_MAX)
+
+def _backoff(retry_state) -> float:
+    """Honors Retry-After when Groq sends one, else jittered exponential backoff."""
+    exc = retry_state.outcome.exception()
+    retry_after = getattr(exc, "retry_after", None)
+    if retry_after is not None:
+        return min(retry_after, UPSTREAM_RETRY_AFTER_MAX)
+    return _jittered_backoff(retry_state)
+
+def _retrying(route: Route) -> AsyncRetrying:
+    def before_sleep(retry_state):
+        scheduler.retries += 1
+        # Keeps the router from hedging onto the route while we wait it out
+        router.backing_off(route, retry_state.upcoming_sleep)
+
+    return AsyncRetrying(
+        stop=stop_after_attempt(UPSTREAM_MAX_ATTEMPTS),
+        wait=_backoff,
+        retry=retry_if_exception(_is_retryable),
+        before_sleep=before_sleep,
+        reraise=True,
+    )
+
+# --- Response Cache ---
+_WHITESPACE_RE = re.compile(r"\s+")
+
+class _Flight:
+    """One in-progress upstream call shared by every identical concurrent request."""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+class _StreamFlight:
+    """One upstream stream fanned out to every identical concurrent request.
+
+    Deltas are kept until the stream ends so a caller that joins late
+    replays the answer from its first delta.
+    """
+
+    def __init__(self):
+        self.chunks: list[str] = []
+        self.error: str | None = None
+        self.done = False
+        self.task: asyncio.Task | None = None
+        self.waiters = 0
+        self._wakeup = asyncio.Event()
+
+    def publish(self, delta: str):
+        self.chunks.append(delta)
+        self._notify()
+
+    def finish(self, error: str | None = None):
+        self.error, self.done = error, True
+        self._notify()
+
+    def _notify(self):
+        self._wakeup.set()
+        self._wakeup = asyncio.Event()
+
+    async def follow(self) -> AsyncIterator[str]:
+        """Same contract as stream_ai_response: an error before any delta is
+        yielded, one after deltas raises StreamInterrupted."""
+        seen = 0
+        while True:
+            if seen < len(self.chunks):
+                seen += 1
+                yield self.chunks[seen - 1]
+            elif self.done:
+                break
+            else:
+                await self._wakeup.wait()
+        if self.error is not None:
+            if seen:
+                raise StreamInterrupted(self.error)
+            yield self.error
+
+class ResponseCache:
+    """TTL + LRU cache of completions, capped by total text size, with single-flight
+    coalescing of identical in-flight completions and streams."""
+
+    def __init__(self, max_bytes: int = RESPONSE_CACHE_MAX_BYTES, ttl: float = RESPONSE_CACHE_TTL):
+        self._entries = TTLCache(maxsize=max_bytes, ttl=ttl, getsizeof=len)
+        self._inflight: dict[str, _Flight] = {}
+        self._streams: dict[str, _StreamFlight] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.bypassed = 0
+
+    @staticmethod
+    def key(payload: dict) -> str:
+        """Hash of the effective request; message text is case/whitespace-normalized."""
+        normalized = {
+            "model": payload["model"],
+            "temperature": payload["temperature"],
+            "messages": [
+                [m["role"], _WHITESPACE_RE.sub(" ", m["content"]).strip().lower()]
+                for m in payload["messages"]
+            ],
+        }
+        return hashlib.sha256(json.dumps(normalized, separators=(",", ":")).encode()).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        text = self._entries.get(key)
+        if text is not None:
+            self.hits += 1
+        return text
+
+    def put(self, key: str, text: str):
+        if len(text) <= self._entries.maxsize:
+            self._entries[key] = text
+
+    async def get_or_fetch(self, key: str, fetch: Callable[[], Awaitable[str]]) -> str:
+        """Returns the cached text, joins an identical in-flight call, or starts one."""
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+
+        flight = self._inflight.get(key)
+        if flight is None:
+            self.misses += 1
+            flight = self._inflight[key] = _Flight(asyncio.create_task(fetch()))
+            flight.task.add_done_callback(lambda task: self._landed(key, flight, task))
+        else:
+            self.coalesced += 1
+
+        flight.waiters += 1
+        try:
+            # shield: one caller cancelling must not abort the call for the others
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Unregister first so an identical request doesn't join the cancelled call
+                if self._inflight.get(key) is flight:
+                    del self._inflight[key]
+                flight.task.cancel()
+
+    def _landed(self, key: str, flight: _Flight, task: asyncio.Task):
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
+        if not task.cancelled() and task.exception() is None:
+            self.put(key, task.result())
+
+    async def stream_or_join(self, key: str | None,
+                             pump: Callable[[_StreamFlight], Awaitable[None]]) -> AsyncIterator[str]:
+        """Follows an identical in-flight stream from its first delta, or starts
+        `pump(flight)` to produce one. With no key the stream isn't shared."""
+        flight = self._streams.get(key) if key is not None else None
+        if flight is None:
+            flight = _StreamFlight()
+            flight.task = asyncio.create_task(pump(flight))
+            if key is not None:
+                self.misses += 1
+                self._streams[key] = flight
+                flight.task.add_done_callback(lambda task: self._stream_landed(key, flight))
+        else:
+            self.coalesced += 1
+
+        flight.waiters += 1
+        try:
+            async for chunk in flight.follow():
+                yield chunk
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Nobody left to read it; unregister now so no one joins a cancelled stream
+                self._stream_landed(key, flight)
+                flight.task.cancel()
+
+    def _stream_landed(self, key: str | None, flight: _StreamFlight):
+        if key is not None and self._streams.get(key) is flight:
+            del self._streams[key]
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "bypassed": self.bypassed,
+            "entries": len(self._entries),
+            "bytes": self._entries.currsize,
+            "in_flight": len(self._inflight) + len(self._streams),
+        }
+
+response_cache = ResponseCache()
+
+def get_cache_stats() -> dict:
+    return response_cache.stats()
+
+def _use_cache(payload: dict, fresh: bool) -> bool:
+    """Fresh output is only meaningful when sampling (temperature > 0)."""
+    if not RESPONSE_CACHE_ENABLED:
+        return False
+    if fresh and payload["temperature"] > 0:
+        response_cache.bypassed += 1
+        return False
+    return True
+
+def _prompt_tokens(payload: dict) -> int:
+    """Rough prompt size (~4 chars per token) for routing short prompts."""
+    return sum(len(m["content"]) for m in payload["messages"]) // 4
+
+async def _send(route: Route, payload: dict, headers: dict, stream: bool = False) -> httpx.Response:
+    """One upstream attempt on `route`, timed by status (headers only when streaming)."""
+    http = _get_client()
+    payload = {**payload, "model": route.model}
+    headers = {**headers, "Authorization": f"Bearer {route.api_key}"}
+    started = time.perf_counter()
+    try:
+        response = await http.send(http.build_request("POST", route.url, json=payload, headers=headers), stream=stream)
+    except httpx.TransportError:
+        UPSTREAM_LATENCY.observe(time.perf_counter() - started, route=route.name, status="error")
+        raise
+    UPSTREAM_LATENCY.observe(time.perf_counter() - started, route=route.name, status=str(response.status_code))
+    return response
+
+# Each attempt takes its own slot, so backoff sleeps (up to UPSTREAM_RETRY_AFTER_MAX)
+# don't hold one while other users time out in the queue
+async def _complete_on(route: Route, username: str, payload: dict, headers: dict) -> str:
+    async for attempt in _retrying(route):
+        with attempt:
+            async with scheduler.slot(username, UPSTREAM_QUEUE_TIMEOUT):
+                response = await _send(route, payload, headers)
+            if response.status_code != 200:
+                raise _upstream_error(response, response.content)
+            return response.json()["choices"][0]["message"]["content"]
+
+async def _open_stream(route: Route, username: str, payload: dict, headers: dict) -> httpx.Response:
+    """Returns the open response still holding its slot; _close_stream gives both back."""
+    async for attempt in _retrying(route):
+        with attempt:
+            await scheduler.acquire(username, UPSTREAM_QUEUE_TIMEOUT)
+            try:
+                response = await _send(route, payload, headers, stream=True)
+                if response.status_code != 200:
+                    body = await response.aread()
+                    await response.aclose()
+                    raise _upstream_error(response, body)
+            except BaseException:
+                scheduler.release()
+                raise
+            return response
+
+async def _close_stream(response: httpx.Response):
+    try:
+        await response.aclose()
+    finally:
+        scheduler.release()
+
+async def _post_completion(username: str, payload: dict, headers: dict) -> str:
+    """Non-streaming completion through admission control, routing and retries; raises on failure."""
+    return await router.call(
+        _prompt_tokens(payload),
+        lambda route: _complete_on(route, username, payload, headers),
+        is_failure=_is_retryable,
+    )
+
+async def _complete(username: str, context_history: list[dict], knowledge: list[str] | None = None) -> str:
+    payload, headers = _build_request(context_history, knowledge=knowledge)
+    return await _post_completion(username, payload, headers)
+
+async def get_ai_response(username: str, context_history: list[dict],
+                          knowledge: list[str] | None = None, fresh: bool = False) -> str:
+    api_key = os.getenv("GROQ_API_KEY")
+    if not api_key:
+        return "ERROR: Groq API Key missing."
+
+    payload, headers = _build_request(context_history, knowledge=knowledge)
+
+    try:
+        if not _use_cache(payload, fresh):
+            return await _post_completion(username, payload, headers)
+        return await response_cache.get_or_fetch(
+            ResponseCache.key(payload), lambda: _post_completion(username, payload, headers)
+        )
+    except QueueTimeout:
+        return "AI Error: Server busy, please try again."
+    except CircuitOpen:
+        return "AI Error: Service temporarily unavailable, please try again."
+    except UpstreamError as e:
+        return f"AI Error: {e}"
+    except Exception as e:
+        logger.warning("❌ Groq API Failure: %s", e)
+        return "AI Error: Connection failed."
+
+async def summarize_history(username: str, previous_summary: str, messages: list[dict],
+                            max_words: int = 200) -> str:
+    """Folds `messages` into `previous_summary`. Raises on failure so callers can retry later."""
+    if not os.getenv("GROQ_API_KEY"):
+        raise UpstreamError("Groq API Key missing.")
+
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    return await _complete(username, [
+        {"role": "system", "content": SUMMARY_PROMPT.format(max_words=max_words)},
+        {"role": "user", "content": f"Previous summary:\n{previous_summary or '(none)'}\n\nNew messages:\n{transcript}"},
+    ])
+
+async def stream_ai_response(username: str, context_history: list[dict],
+                             knowledge: list[str] | None = None, fresh: bool = False) -> AsyncIterator[str]:
+    """Yields content deltas from Groq's SSE stream as they arrive.
+
+    Errors before any content are yielded as a single "AI Error: ..." chunk so
+    callers can treat the stream exactly like the text returned by
+    get_ai_response. If the stream breaks (or ends without [DONE]) after
+    content was yielded, StreamInterrupted is raised instead: the partial
+    text is not an answer. A cache hit is yielded as one chunk; identical
+    concurrent streams share one upstream call, and completed streams
+    populate the cache.
+    """
+    api_key = os.getenv("GROQ_API_KEY")
+    if not api_key:
+        yield "ERROR: Groq API Key missing."
+        return
+
+    payload, headers = _build_request(context_history, stream=True, knowledge=knowledge)
+
+    cache_key = None
+    if _use_cache(payload, fresh):
+        cache_key = ResponseCache.key(payload)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+
+    async for chunk in response_cache.stream_or_join(
+        cache_key, lambda flight: _pump_stream(flight, username, payload, headers, cache_key)
+    ):
+        yield chunk
+
+async def _pump_stream(flight: _StreamFlight, username: str, payload: dict, headers: dict,
+                       cache_key: str | None):
+    """Reads one upstream stream into `flight`; always finishes it unless cancelled."""
+    completed, error = False, None
+    try:
+        # Only opening the stream is retried/hedged; its slot is held until it's read
+        response = await router.call(
+            _prompt_tokens(payload),
+            lambda route: _open_stream(route, username, payload, headers),
+            stream=True,
+            is_failure=_is_retryable,
+            discard=_close_stream,
+        )
+
+        try:
+            # SSE framing: "data: {json}" lines, terminated by "data: [DONE]"
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    completed = True
+                    break
+                delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                if delta:
+                    flight.publish(delta)
+        finally:
+            await _close_stream(response)
+        if not completed:
+            error = "AI Error: Stream ended before the answer was complete."
+        elif cache_key is not None:
+            # Only cache streams that ran to the end
+            response_cache.put(cache_key, "".join(flight.chunks))
+    except QueueTimeout:
+        error = "AI Error: Server busy, please try again."
+    except CircuitOpen:
+        error = "AI Error: Service temporarily unavailable, please try again."
+    except UpstreamError as e:
+        error = f"AI Error: {e}"
     except Exception as e:
-        print(f"❌ Groq API Failure: {str(e)}")
-        return "AI Error: Connection failed."
\ No newline at end of file
+        logger.warning("❌ Groq API Failure: %s", e)
+        error = "AI Error: Connection failed."
+    flight.finish(error)
@@ -2,6 +2,7 @@
 import time
 from jose import jwt, JWTError
 from fastapi import status, HTTPException
+from metrics import JWT_DECODE
 
 # --- JWT Configuration ---
 SECRET_KEY = "YOUR_SUPER_SECRET_KEY_REPLACE_ME" 
@@ -27,19 +28,20 @@ def create_access_token(user_id: str) -> str:
 # --- Function 2: Decode/Verify JWT Token (Used in WebSocket dependency) ---
 def decode_access_token(token: str) -> str | None:
     """Decodes and validates a JWT token, returning the user_id if valid."""
-    try:
-        # Decode and verify the token
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        
-        # Check if the token has expired
-        if payload.get("exp") < time.time():
-            return None # Token expired
+    with JWT_DECODE.time():
+        try:
+            # Decode and verify the token
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
             
-        return payload.get("user_id")
-        
-    except JWTError:
-        # This catches signature errors, wrong algorithm, etc.
-        return None # Invalid token
-    except Exception:
-        # Catch any other unexpected decoding errors
-        return None
\ No newline at end of file
+            # Check if the token has expired
+            if payload.get("exp") < time.time():
+                return None # Token expired
+                
+            return payload.get("user_id")
+            
+        except JWTError:
+            # This catches signature errors, wrong algorithm, etc.
+            return None # Invalid token
+        except Exception:
+            # Catch any other unexpected decoding errors
+            return None
\ No newline at end of file
@@ -0,0 +1,118 @@
+# bench/fake_groq.py
+"""Local stand-in for Groq's OpenAI-compatible chat completions endpoint.
+
+Point the backend at it with GROQ_API_URL, e.g.:
+
+    python bench/fake_groq.py --port 9000 --latency-median-ms 800 --rate-limit-rate 0.02
+    GROQ_API_KEY=fake GROQ_API_URL=http://127.0.0.1:9000/openai/v1/chat/completions \
+        gunicorn main:app --workers 4 --worker-class uvicorn.workers.UvicornWorker --bind 0.0.0.0:8000
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = (
+    "the quick brown fox jumps over the lazy dog while a helpful assistant "
+    "explains latency throughput and queueing in plain words"
+).split()
+
+
+class FakeConfig:
+    """Latency/error knobs; latency is lognormal around the median."""
+
+    def __init__(self, args: argparse.Namespace):
+        self.latency_median = args.latency_median_ms / 1000
+        self.latency_sigma = args.latency_sigma
+        self.tokens = args.tokens
+        self.token_interval = args.token_interval_ms / 1000
+        self.error_rate = args.error_rate
+        self.rate_limit_rate = args.rate_limit_rate
+        self.retry_after = args.retry_after
+
+    def first_token_delay(self) -> float:
+        return random.lognormvariate(0, self.latency_sigma) * self.latency_median
+
+
+def create_app(config: FakeConfig) -> FastAPI:
+    app = FastAPI(title="Fake Groq")
+    stats = {"requests": 0, "rate_limited": 0, "errors": 0}
+
+    def completion_text() -> str:
+        return " ".join(random.choice(WORDS) for _ in range(config.tokens))
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    @app.post("/openai/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+
+        roll = random.random()
+        if roll < config.rate_limit_rate:
+            stats["rate_limited"] += 1
+            return JSONResponse(
+                {"error": {"message": "Rate limit reached (fake)"}},
+                status_code=429,
+                headers={"retry-after": str(config.retry_after)},
+            )
+        if roll < config.rate_limit_rate + config.error_rate:
+            stats["errors"] += 1
+            return JSONResponse({"error": {"message": "Internal error (fake)"}}, status_code=500)
+
+        await asyncio.sleep(config.first_token_delay())
+        text = completion_text()
+
+        if body.get("stream"):
+            async def events():
+                created = int(time.time())
+                for i, word in enumerate(text.split(" ")):
+                    if i:
+                        await asyncio.sleep(config.token_interval)
+                    chunk = {
+                        "object": "chat.completion.chunk",
+                        "created": created,
+                        "model": body.get("model"),
+                        "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}],
+                    }
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                yield "data: [DONE]\n\n"
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        # Non-streaming callers still pay for the whole generation
+        await asyncio.sleep(config.token_interval * max(0, config.tokens - 1))
+        return {
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+        }
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency-median-ms", type=float, default=500, help="median time to first token")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="lognormal sigma (0 = constant)")
+    parser.add_argument("--tokens", type=int, default=40, help="words per completion")
+    parser.add_argument("--token-interval-ms", type=float, default=20, help="delay between streamed words")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    args = parser.parse_args()
+
+    uvicorn.run(create_app(FakeConfig(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+# bench/load_test.py
+"""Load test / latency benchmark for the chat backend.
+
+Logs in concurrently, then opens N authenticated WebSockets that each run
+M streamed turns, and reports login throughput, turn latency, time to first
+token, messages/sec and per-worker memory. Results are written as JSON;
+pass --compare with an earlier result file to print the deltas.
+
+With --users K the sockets are spread round-robin over K accounts
+(loaduser0..loaduserK-1) instead of all sharing --username; --seed creates
+any that are missing (run it on the server host, it writes user_auth.db).
+
+    python bench/load_test.py --connections 200 --turns 5 --output run.json
+    python bench/load_test.py --connections 200 --users 200 --seed --compare run.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+
+import httpx
+import websockets
+
+
+def percentile(values: list[float], pct: float) -> float | None:
+    """Linear-interpolated percentile (pct in 0..100)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize_ms(values: list[float]) -> dict:
+    """Seconds in, milliseconds out."""
+    ms = [v * 1000 for v in values]
+    return {
+        "count": len(ms),
+        "mean": round(sum(ms) / len(ms), 2) if ms else None,
+        "p50": _round(percentile(ms, 50)),
+        "p95": _round(percentile(ms, 95)),
+        "p99": _round(percentile(ms, 99)),
+        "max": _round(max(ms)) if ms else None,
+    }
+
+
+def _round(value: float | None) -> float | None:
+    return None if value is None else round(value, 2)
+
+
+# --- Worker Memory ---
+def find_worker_pids(pattern: str) -> list[int]:
+    """PIDs whose command line contains `pattern`, plus their direct children
+    (uvicorn --workers spawns workers with a different cmdline). Linux /proc only."""
+    if not os.path.isdir("/proc"):
+        return []
+    matched, parents = set(), {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit() or int(entry) == os.getpid():
+            continue
+        pid = int(entry)
+        try:
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                cmdline = f.read().replace(b"\0", b" ").decode(errors="replace")
+            with open(f"/proc/{pid}/stat") as f:
+                parents[pid] = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        if pattern in cmdline:
+            matched.add(pid)
+    children = {pid for pid, ppid in parents.items() if ppid in matched}
+    return sorted(matched | children)
+
+
+def rss_mb(pid: int) -> float | None:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+class MemorySampler:
+    """Samples RSS of matching processes in the background; keeps start/peak/end per PID."""
+
+    def __init__(self, pattern: str, interval: float = 0.5):
+        self.pattern = pattern
+        self.interval = interval
+        self.samples: dict[int, dict] = {}
+        self._task: asyncio.Task | None = None
+
+    def sample(self):
+        for pid in find_worker_pids(self.pattern):
+            rss = rss_mb(pid)
+            if rss is None:
+                continue
+            entry = self.samples.setdefault(pid, {"start_mb": rss, "peak_mb": rss, "end_mb": rss})
+            entry["peak_mb"] = max(entry["peak_mb"], rss)
+            entry["end_mb"] = rss
+
+    async def _run(self):
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> dict:
+        self._task.cancel()
+        self.sample()
+        return {str(pid): {k: round(v, 1) for k, v in entry.items()} for pid, entry in self.samples.items()}
+
+
+# --- Accounts ---
+def usernames(args) -> list[str]:
+    if args.users <= 1:
+        return [args.username]
+    return [f"{args.user_prefix}{i}" for i in range(args.users)]
+
+
+def seed_users(args):
+    """Adds the missing --users accounts straight to the server's database."""
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from initial_setup import add_users
+    added = add_users(usernames(args), args.password)
+    print(f"🌱 Seeded {added} of {args.users} load-test accounts")
+
+
+# --- Phases ---
+async def run_logins(args) -> tuple[dict, dict[str, str]]:
+    """Times --logins requests spread over the accounts (each logs in at least
+    once) and returns one token per account that succeeded."""
+    url = f"{args.base_url}/api/v1/auth/login"
+    accounts = usernames(args)
+    requests = max(args.logins, len(accounts))
+    latencies, failures, tokens = [], 0, {}
+    semaphore = asyncio.Semaphore(args.login_concurrency)
+
+    async with httpx.AsyncClient(timeout=30) as http:
+        async def one(username: str):
+            nonlocal failures
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await http.post(url, json={"username": username, "password": args.password})
+                    response.raise_for_status()
+                    tokens[username] = response.json()["token"]
+                    latencies.append(time.perf_counter() - started)
+                except Exception:
+                    failures += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(accounts[i % len(accounts)]) for i in range(requests)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": requests,
+        "users": len(accounts),
+        "failures": failures,
+        "elapsed_s": round(elapsed, 3),
+        "logins_per_s": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "latency_ms": summarize_ms(latencies),
+    }, tokens
+
+
+async def run_connection(args, token: str, index: int, results: dict):
+    uri = f"{args.ws_url}/api/v1/ai/chat?token={token}"
+    try:
+        async with websockets.connect(uri, open_timeout=30, max_size=None) as ws:
+            results["connected"] += 1
+            for turn in range(args.turns):
+                request_id = uuid.uuid4().hex
+                question = args.question if args.cacheable else f"{args.question} (conn {index}, turn {turn}, {request_id[:8]})"
+                started = time.perf_counter()
+                first_token = None
+                await ws.send(json.dumps({"data": question, "request_id": request_id, "stream": not args.no_stream}))
+                while True:
+                    message = json.loads(await asyncio.wait_for(ws.recv(), timeout=args.turn_timeout))
+                    if message.get("type") == "ping":
+                        await ws.send(json.dumps({"type": "pong", "ts": message.get("ts")}))
+                        continue
+                    if message.get("request_id") != request_id:
+                        continue
+                    if message.get("type") == "ai_chunk" and first_token is None:
+                        first_token = time.perf_counter() - started
+                    elif message.get("type") == "ai_response":
+                        results["turn_latency"].append(time.perf_counter() - started)
+                        results["ttft"].append(first_token if first_token is not None else time.perf_counter() - started)
+                        if str(message.get("data", "")).startswith(("AI Error", "ERROR")):
+                            results["ai_errors"] += 1
+                        results["turns"] += 1
+                        break
+                    elif message.get("type") == "error":
+                        results["rejected"] += 1
+                        break
+                if args.think_time:
+                    await asyncio.sleep(args.think_time)
+    except Exception as e:
+        results["connection_errors"] += 1
+        results["errors"].append(f"{type(e).__name__}: {e}")
+
+
+async def run_chat(args, tokens: list[str]) -> dict:
+    results = {
+        "connected": 0, "connection_errors": 0, "turns": 0, "ai_errors": 0, "rejected": 0,
+        "turn_latency": [], "ttft": [], "errors": [],
+    }
+
+    async def ramped(index: int):
+        if args.ramp_up:
+            await asyncio.sleep(args.ramp_up * index / args.connections)
+        await run_connection(args, tokens[index % len(tokens)], index, results)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(ramped(i) for i in range(args.connections)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "connections": args.connections,
+        "users": len(tokens),
+        "connected": results["connected"],
+        "connection_errors": results["connection_errors"],
+        "turns": results["turns"],
+        "ai_errors": results["ai_errors"],
+        "rejected": results["rejected"],
+        "elapsed_s": round(elapsed, 3),
+        "messages_per_s": round(results["turns"] / elapsed, 2) if elapsed else None,
+        "turn_latency_ms": summarize_ms(results["turn_latency"]),
+        "ttft_ms": summarize_ms(results["ttft"]),
+        "sample_errors": sorted(set(results["errors"]))[:10],
+    }
+
+
+# --- Reporting ---
+COMPARED_METRICS = [
+    ("login", "logins_per_s"),
+    ("login", "latency_ms.p95"),
+    ("chat", "messages_per_s"),
+    ("chat", "turn_latency_ms.p50"),
+    ("chat", "turn_latency_ms.p95"),
+    ("chat", "turn_latency_ms.p99"),
+    ("chat", "ttft_ms.p50"),
+    ("chat", "ttft_ms.p95"),
+    ("chat", "ttft_ms.p99"),
+]
+
+
+def _lookup(result: dict, section: str, path: str):
+    value = result.get(section, {})
+    for key in path.split("."):
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+
+def print_comparison(current: dict, baseline: dict):
+    print(f"\n{'metric':<28}{'baseline':>12}{'current':>12}{'change':>10}")
+    for section, path in COMPARED_METRICS:
+        before, after = _lookup(baseline, section, path), _lookup(current, section, path)
+        change = f"{(after - before) / before * 100:+.1f}%" if before and after is not None else "n/a"
+        print(f"{section + '.' + path:<28}{str(before):>12}{str(after):>12}{change:>10}")
+
+
+async def main_async(args) -> dict:
+    sampler = MemorySampler(args.server_pattern)
+    sampler.start()
+
+    login, tokens = await run_logins(args)
+    print(f"🔐 logins: {login['logins_per_s']}/s, p95 {login['latency_ms']['p95']} ms, {login['failures']} failed")
+    if not tokens:
+        raise SystemExit("❌ No successful login; is the server running and the user seeded?")
+    if len(tokens) < login["users"]:
+        print(f"⚠️ Only {len(tokens)} of {login['users']} accounts logged in; sockets share those")
+
+    chat = await run_chat(args, list(tokens.values()))
+    print(
+        f"💬 {chat['turns']} turns at {chat['messages_per_s']}/s | "
+        f"latency p50/p95/p99 {chat['turn_latency_ms']['p50']}/{chat['turn_latency_ms']['p95']}/{chat['turn_latency_ms']['p99']} ms | "
+        f"TTFT p50/p95/p99 {chat['ttft_ms']['p50']}/{chat['ttft_ms']['p95']}/{chat['ttft_ms']['p99']} ms"
+    )
+
+    memory = await sampler.stop()
+    for pid, entry in memory.items():
+        print(f"🧠 pid {pid}: {entry['start_mb']} -> peak {entry['peak_mb']} MB")
+
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "host": platform.node(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("password", "output", "compare")},
+        "login": login,
+        "chat": chat,
+        "worker_memory_mb": memory,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--ws-url", default=None, help="defaults to --base-url with ws://")
+    parser.add_argument("--username", default="testuser")
+    parser.add_argument("--password", default="password123")
+    parser.add_argument("--users", type=int, default=1, help="distinct accounts to spread sockets over (1 = --username)")
+    parser.add_argument("--user-prefix", default="loaduser", help="account names are <prefix>0..<prefix>N-1")
+    parser.add_argument("--seed", action="store_true", help="create missing --users accounts in the local database first")
+    parser.add_argument("--logins", type=int, default=200, help="login requests to time")
+    parser.add_argument("--login-concurrency", type=int, default=50)
+    parser.add_argument("--connections", type=int, default=50, help="concurrent WebSockets")
+    parser.add_argument("--turns", type=int, default=5, help="turns per WebSocket")
+    parser.add_argument("--ramp-up", type=float, default=2.0, help="seconds to spread connection opens over")
+    parser.add_argument("--think-time", type=float, default=0.0, help="pause between a connection's turns")
+    parser.add_argument("--turn-timeout", type=float, default=60.0)
+    parser.add_argument("--question", default="Explain what p99 latency means.")
+    parser.add_argument("--cacheable", action="store_true", help="send identical questions (exercise the response cache)")
+    parser.add_argument("--no-stream", action="store_true", help="disable token streaming (TTFT == turn latency)")
+    parser.add_argument("--server-pattern", default="main:app", help="cmdline substring identifying server workers")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", default=None, help="earlier result JSON to diff against")
+    args = parser.parse_args()
+    args.base_url = args.base_url.rstrip("/")
+    args.ws_url = (args.ws_url or args.base_url.replace("http", "ws", 1)).rstrip("/")
+
+    if args.seed:
+        seed_users(args)
+    result = asyncio.run(main_async(args))
+
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"📄 Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
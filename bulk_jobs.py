@@ -0,0 +1,155 @@
+# bulk_jobs.py
+"""Runs a JSONL batch of independent prompts and streams NDJSON results.
+
+Each input line is a JSON object with the prompt in `data` (or `prompt`),
+or a requests.jsonl-style `title` + `body`. Optional fields: `request_id`
+(echoed back), `mode: "rag"` and `fresh`. Prompts don't read or write chat
+memory; they share the chat pipeline's cache, admission control and routing.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+import tempfile
+from typing import AsyncIterator, BinaryIO
+
+from starlette.requests import Request
+
+from ai_client import get_ai_response
+from knowledge_base import retrieve
+from metrics import BULK_PROMPTS
+
+logger = logging.getLogger(__name__)
+
+# --- Bulk Configuration ---
+BULK_MAX_PARALLEL = int(os.getenv("BULK_MAX_PARALLEL", "4"))
+BULK_MAX_UPLOAD_BYTES = int(os.getenv("BULK_MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+BULK_MAX_PROMPT_CHARS = int(os.getenv("BULK_MAX_PROMPT_CHARS", "20000"))
+# Upload bytes buffered before each write to the spool file
+SPOOL_WRITE_BYTES = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+async def spool_upload(request: Request) -> BinaryIO:
+    """Copies the request body to an anonymous temp file and returns it rewound.
+
+    The upload is drained before any result is sent: most HTTP clients only
+    read the response once they've finished sending, so reading the body at
+    the pace results are consumed could deadlock a large batch.
+    """
+    spool = tempfile.TemporaryFile()
+    size, buffer = 0, bytearray()
+    try:
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > BULK_MAX_UPLOAD_BYTES:
+                raise UploadTooLarge(f"Upload exceeds {BULK_MAX_UPLOAD_BYTES} bytes.")
+            buffer += chunk
+            if len(buffer) >= SPOOL_WRITE_BYTES:
+                await asyncio.to_thread(spool.write, bytes(buffer))
+                buffer.clear()
+        await asyncio.to_thread(spool.write, bytes(buffer))
+        spool.seek(0)
+    except BaseException:
+        spool.close()
+        raise
+    return spool
+
+
+def _prompt_of(item: dict) -> str:
+    prompt = item.get("data") or item.get("prompt")
+    if prompt is None:
+        prompt = "\n\n".join(str(item[k]) for k in ("title", "body") if item.get(k))
+    if not isinstance(prompt, str):
+        raise ValueError("prompt must be a string")
+    return prompt.strip()
+
+
+async def _answer_line(username: str, line_no: int, raw: bytes) -> dict:
+    """One line in, one result out; never raises."""
+    result = {"line": line_no, "request_id": None}
+    try:
+        item = json.loads(raw)
+        if not isinstance(item, dict):
+            raise ValueError("expected a JSON object")
+        result["request_id"] = item.get("request_id")
+        prompt = _prompt_of(item)
+        if not prompt:
+            raise ValueError("no prompt (data, prompt, or title/body)")
+        if len(prompt) > BULK_MAX_PROMPT_CHARS:
+            raise ValueError(f"prompt longer than {BULK_MAX_PROMPT_CHARS} characters")
+    except ValueError as e:
+        BULK_PROMPTS.inc(outcome="invalid")
+        return {**result, "status": "invalid", "error": str(e)}
+
+    started = time.perf_counter()
+    try:
+        knowledge = None
+        if item.get("mode") == "rag":
+            knowledge = await asyncio.to_thread(retrieve, username, prompt)
+        answer = await get_ai_response(
+            username=username,
+            context_history=[{"role": "user", "content": prompt}],
+            knowledge=knowledge,
+            fresh=bool(item.get("fresh"))
+        )
+    except Exception as e:
+        logger.warning("❌ Bulk line %d failed for %s: %s", line_no, username, e)
+        answer = f"AI Error: {e}"
+    latency_ms = round((time.perf_counter() - started) * 1000, 1)
+
+    if answer.startswith(("AI Error", "ERROR")):
+        BULK_PROMPTS.inc(outcome="error")
+        return {**result, "status": "error", "error": answer, "latency_ms": latency_ms}
+    BULK_PROMPTS.inc(outcome="ok")
+    return {**result, "status": "ok", "answer": answer, "latency_ms": latency_ms}
+
+
+async def run_bulk(username: str, spool: BinaryIO) -> AsyncIterator[str]:
+    """Yields one NDJSON result per non-blank input line, in completion order.
+
+    BULK_MAX_PARALLEL workers pull lines from the spool file on demand and
+    the result queue is bounded, so a slow reader pauses the workers instead
+    of piling results up in memory. Closes `spool` when done.
+    """
+    results: asyncio.Queue = asyncio.Queue(maxsize=BULK_MAX_PARALLEL)
+    read_lock = asyncio.Lock()
+    line_no = 0
+
+    async def next_line() -> tuple[int, bytes] | None:
+        nonlocal line_no
+        async with read_lock:
+            while True:
+                raw = await asyncio.to_thread(spool.readline)
+                if not raw:
+                    return None
+                line_no += 1
+                if raw.strip():
+                    return line_no, raw
+
+    async def worker():
+        while (job := await next_line()) is not None:
+            await results.put(await _answer_line(username, *job))
+
+    async def close_when_done(workers: list[asyncio.Task]):
+        for outcome in await asyncio.gather(*workers, return_exceptions=True):
+            if isinstance(outcome, Exception):
+                logger.error("❌ Bulk worker failed for %s: %s", username, outcome)
+                await results.put({"line": None, "status": "error", "error": f"Batch aborted: {outcome}"})
+        await results.put(None)
+
+    workers = [asyncio.create_task(worker()) for _ in range(BULK_MAX_PARALLEL)]
+    closer = asyncio.create_task(close_when_done(workers))
+    try:
+        while (result := await results.get()) is not None:
+            yield json.dumps(result) + "\n"
+    finally:
+        # Client went away (or we're done): stop pulling lines and drop pending calls
+        closer.cancel()
+        for task in workers:
+            task.cancel()
+        spool.close()
@@ -0,0 +1,170 @@
+# connection_manager.py
+"""Per-worker WebSocket lifecycle: connection cap, heartbeats, idle reaping and graceful drain."""
+import os
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+from fastapi import WebSocket, status
+
+from metrics import WS_ACTIVE_CONNECTIONS, WS_SERVER_CLOSES
+
+logger = logging.getLogger(__name__)
+
+# --- Connection Configuration ---
+MAX_CONNECTIONS_PER_WORKER = int(os.getenv("MAX_CONNECTIONS_PER_WORKER", "1000"))
+# Server sends {"type": "ping"} this often; clients answer {"type": "pong"}
+WS_PING_INTERVAL = float(os.getenv("WS_PING_INTERVAL", "20"))
+# A client with no turn running that's silent for WS_PING_INTERVAL + WS_PONG_TIMEOUT
+# is considered dead. Mid-turn, dead peers are caught by uvicorn's protocol-level
+# pings (ws_ping_interval / ws_ping_timeout, 20s each by default), which browsers
+# answer on their own.
+WS_PONG_TIMEOUT = float(os.getenv("WS_PONG_TIMEOUT", "20"))
+# Closed after this long with no questions and nothing generating
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "900"))
+WS_CLOSE_TIMEOUT = float(os.getenv("WS_CLOSE_TIMEOUT", "5"))
+# How long shutdown waits for in-flight turns; keep below gunicorn's --graceful-timeout
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "20"))
+
+
+class Connection:
+    """One accepted chat socket and the turns it has generating."""
+
+    def __init__(self, websocket: WebSocket, username: str):
+        self.websocket = websocket
+        self.username = username
+        self.in_flight: dict[str, asyncio.Task] = {}
+        self.last_seen = self.last_active = self.busy_at = time.monotonic()
+        self.closing = False
+        self.ping: asyncio.Task | None = None
+        # Turns run as concurrent tasks; serialize their writes to the socket
+        self._send_lock = asyncio.Lock()
+
+    def touch(self, active: bool = True):
+        """Records a frame from the client; pongs prove liveness but aren't activity."""
+        self.last_seen = time.monotonic()
+        if active:
+            self.last_active = self.last_seen
+
+    def idle_for(self, now: float) -> float:
+        return 0.0 if self.in_flight else now - self.last_active
+
+    def silent_for(self, now: float) -> float:
+        """A client busy reading an answer may not get round to pongs, so the
+        pong window only starts once its turns have finished."""
+        if self.in_flight:
+            self.busy_at = now
+        return now - max(self.last_seen, self.busy_at)
+
+    async def send(self, message: dict):
+        async with self._send_lock:
+            await self.websocket.send_json(message)
+
+    async def close(self, code: int, reason: str):
+        if self.closing:
+            return
+        self.closing = True
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code, reason=reason), WS_CLOSE_TIMEOUT)
+        except Exception as e:
+            # Already gone; the receive loop sees the disconnect and cleans up
+            logger.debug("Close of %s's socket failed: %s", self.username, e)
+
+
+class ConnectionManager:
+    def __init__(self, max_connections: int = MAX_CONNECTIONS_PER_WORKER):
+        self.max_connections = max_connections
+        self.connections: set[Connection] = set()
+        self.draining = False
+        self._heartbeat: asyncio.Task | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    # --- Admission ---
+    def rejection(self) -> tuple[int, str] | None:
+        """Close code and reason for a new socket we can't take, else None."""
+        if self.draining:
+            WS_SERVER_CLOSES.inc(reason="draining")
+            return status.WS_1012_SERVICE_RESTART, "Server restarting"
+        if len(self.connections) >= self.max_connections:
+            WS_SERVER_CLOSES.inc(reason="capacity")
+            return status.WS_1013_TRY_AGAIN_LATER, "Server at capacity"
+        return None
+
+    def register(self, websocket: WebSocket, username: str) -> Connection:
+        conn = Connection(websocket, username)
+        self.connections.add(conn)
+        WS_ACTIVE_CONNECTIONS.inc()
+        return conn
+
+    def unregister(self, conn: Connection):
+        if conn in self.connections:
+            self.connections.discard(conn)
+            WS_ACTIVE_CONNECTIONS.dec()
+        if conn.ping is not None:
+            conn.ping.cancel()
+
+    # --- Heartbeats & Idle Reaping ---
+    def start(self):
+        if self._heartbeat is None:
+            self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+
+    def stop(self):
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+
+    def _spawn(self, coro: Awaitable):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _ping(self, conn: Connection):
+        try:
+            await conn.send({"type": "ping", "ts": int(time.time())})
+        except Exception:
+            pass  # the receive loop notices the dead socket
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(WS_PING_INTERVAL)
+            now = time.monotonic()
+            for conn in list(self.connections):
+                if conn.closing:
+                    continue
+                if conn.silent_for(now) > WS_PING_INTERVAL + WS_PONG_TIMEOUT:
+                    WS_SERVER_CLOSES.inc(reason="heartbeat")
+                    logger.debug("💔 %s missed heartbeats; closing", conn.username)
+                    self._spawn(conn.close(status.WS_1001_GOING_AWAY, "Heartbeat timeout"))
+                elif conn.idle_for(now) > WS_IDLE_TIMEOUT:
+                    WS_SERVER_CLOSES.inc(reason="idle")
+                    logger.debug("💤 %s idle; closing", conn.username)
+                    self._spawn(conn.close(status.WS_1000_NORMAL_CLOSURE, "Idle timeout"))
+                elif conn.ping is None or conn.ping.done():
+                    # A ping still stuck behind a slow client isn't doubled up
+                    conn.ping = asyncio.create_task(self._ping(conn))
+
+    # --- Graceful Drain ---
+    async def drain(self, flush: Callable[[], Awaitable[None]] | None = None, timeout: float = DRAIN_TIMEOUT):
+        """Stops taking sockets and turns, lets running turns finish (cancelling
+        any left at the deadline), runs `flush`, then closes every socket with 1012."""
+        self.draining = True
+        turns = [task for conn in self.connections for task in conn.in_flight.values()]
+        if turns:
+            logger.info("⏳ Draining %d in-flight turns (up to %.0fs)", len(turns), timeout)
+            _, pending = await asyncio.wait(turns, timeout=timeout)
+            if pending:
+                logger.warning("⚠️ Cancelling %d turns still running at the drain deadline", len(pending))
+                for task in pending:
+                    task.cancel()
+                await asyncio.wait(pending)
+        if flush is not None:
+            await flush()
+        await asyncio.gather(
+            *(conn.close(status.WS_1012_SERVICE_RESTART, "Server restarting") for conn in list(self.connections)),
+            return_exceptions=True
+        )
+        logger.info("✅ Connections drained.")
+
+
+connections = ConnectionManager()
@@ -0,0 +1,97 @@
+# context_manager.py
+import os
+import asyncio
+import logging
+
+from ai_client import summarize_history
+from state_manager import USER_CONTEXT_STORE, Summary
+
+logger = logging.getLogger(__name__)
+
+# --- Budget Configuration ---
+# Approximate tokens of conversation sent per turn (summary + recent turns verbatim)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+# Target length of the running summary, in words
+SUMMARY_MAX_WORDS = int(os.getenv("SUMMARY_MAX_WORDS", "200"))
+# Max tokens of old turns folded into the summary per background refresh
+SUMMARY_BATCH_TOKENS = int(os.getenv("SUMMARY_BATCH_TOKENS", "2000"))
+
+# Per-message framing overhead in the chat format (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+# Running summary refreshes, at most one per user; entries remove themselves when done
+# (the summary itself lives in the conversation store, bounded by its LRU)
+_refresh_tasks: dict[str, asyncio.Task] = {}
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 chars per token for English text)."""
+    return len(text) // 4 + 1
+
+
+def message_tokens(message: dict) -> int:
+    """Token count for a message, computed once and cached on the message itself."""
+    tokens = message.get("tokens")
+    if tokens is None:
+        tokens = estimate_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+        message["tokens"] = tokens
+    return tokens
+
+
+def build_context(username: str, history: list[dict]) -> list[dict]:
+    """Returns the bounded message list to send upstream for `history`.
+
+    The newest turns are kept verbatim while they fit in CONTEXT_TOKEN_BUDGET
+    (the last message is always kept). Anything older is represented by the
+    user's running summary from the store, which is refreshed in the background;
+    older turns it doesn't cover yet stay verbatim, over budget, until it does.
+    """
+    summary = USER_CONTEXT_STORE.get_summary(username)
+    summary_tokens = estimate_tokens(summary.text) + MESSAGE_OVERHEAD_TOKENS if summary else 0
+
+    budget = CONTEXT_TOKEN_BUDGET - summary_tokens
+    start = len(history)
+    while start > 0:
+        cost = message_tokens(history[start - 1])
+        if budget - cost < 0 and start < len(history):
+            break
+        budget -= cost
+        start -= 1
+
+    through = summary.through if summary else 0
+    pending = [m for m in history[:start] if m["seq"] >= through]
+    if pending and username not in _refresh_tasks:
+        task = asyncio.create_task(_refresh_summary(username, summary, pending))
+        _refresh_tasks[username] = task
+        task.add_done_callback(lambda t: _refresh_tasks.pop(username, None))
+    if pending:
+        # Not in the summary yet (refresh running or failing): don't drop them meanwhile
+        start = history.index(pending[0])
+
+    context = history[start:]
+    if summary:
+        context = [{"role": "system", "content": f"Summary of the earlier conversation:\n{summary.text}"}] + context
+    return context
+
+
+async def _refresh_summary(username: str, previous: Summary | None, pending: list[dict]):
+    """Folds the oldest unsummarized turns into the running summary."""
+    batch, used = [], 0
+    for m in pending:
+        if batch and used + message_tokens(m) > SUMMARY_BATCH_TOKENS:
+            break
+        batch.append(m)
+        used += message_tokens(m)
+
+    try:
+        text = await summarize_history(
+            username, previous.text if previous else "", batch, max_words=SUMMARY_MAX_WORDS
+        )
+    except Exception as e:
+        # Keep the old summary; the same turns are retried on the next turn
+        logger.warning("⚠️ Summary refresh failed for %s: %s", username, e)
+        return
+
+    # Progress is recorded by seq, so it survives reloads and is shared by every worker
+    USER_CONTEXT_STORE.set_summary(username, Summary(text.strip(), batch[-1]["seq"] + 1))
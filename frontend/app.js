@@ -105,35 +105,239 @@ function connectWebSocket() {
 
     socket.onmessage = (event) => {
         const msg = JSON.parse(event.data);
-        const container = document.getElementById("messages");
-        container.innerHTML += `
-            <div class="log">
-                <div style="font-size:10px; color:#a0aec0; margin-bottom:5px;">${msg.timestamp}</div>
-                <b>You:</b> ${msg.query}<br>
-                <div style="margin-top:8px;"><b>AI:</b> ${msg.data}</div>
-            </div>`;
-        container.scrollTop = container.scrollHeight;
+        // Server heartbeat: unanswered pings get the socket closed as dead
+        if (msg.type === "ping") {
+            socket.send(JSON.stringify({ type: "pong", ts: msg.ts }));
+            return;
+        }
+        const row = pendingTurns.get(msg.request_id) || addTurn(msg.request_id, msg.query || "");
+
+        if (msg.type === "ai_chunk") {
+            appendAnswer(row, msg.data);
+            return;
+        }
+        // ai_response / error / cancelled all finish the turn
+        pendingTurns.delete(msg.request_id);
+        if (msg.type === "ai_response") setAnswer(row, msg.data, msg.timestamp);
+        else if (msg.type === "cancelled") setAnswer(row, row.answer + " [cancelled]", "");
+        else setAnswer(row, `⚠️ ${msg.data}`, "");
     };
+
+    socket.onclose = (event) => {
+        // Unanswered questions won't get a reply on this socket
+        for (const row of pendingTurns.values()) setAnswer(row, row.answer + " [connection closed]", "");
+        pendingTurns.clear();
+
+        // 1012: server restarting, 1013: server full, 1001: heartbeat timeout -> reconnect
+        if ([1001, 1012, 1013].includes(event.code)) {
+            const delay = 1000 + Math.random() * 2000;
+            addSystemMessage(`Connection closed (${event.reason || event.code}); reconnecting…`);
+            setTimeout(connectWebSocket, delay);
+        } else if (event.code === 1000 && event.reason) {
+            addSystemMessage(`Disconnected: ${event.reason}. Send a message to reconnect.`);
+            socket = null;
+        } else {
+            socket = null;
+        }
+    };
+}
+
+function newRequestId() {
+    if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+    return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
 }
 
 function sendMessage() {
     const input = document.getElementById("message-input");
-    if (!socket || !input.value.trim()) return;
+    if (!authToken || !input.value.trim()) return;
+    // Idle sockets are closed by the server; reconnect and send once open
+    if (!socket || socket.readyState > WebSocket.OPEN) connectWebSocket();
+    if (socket.readyState === WebSocket.CONNECTING) {
+        socket.addEventListener("open", sendMessage, { once: true });
+        return;
+    }
 
-    // We send a 'mode' flag so the backend knows whether to look in Qdrant
+    // Answers are streamed back as ai_chunk frames tagged with this request_id
+    const requestId = newRequestId();
+    // We send a 'mode' flag so the backend knows whether to search the knowledge base
     const payload = {
         data: input.value,
+        request_id: requestId,
+        stream: true,
         mode: isRagMode ? "rag" : "context" 
     };
 
     socket.send(JSON.stringify(payload));
+    addTurn(requestId, input.value.trim(), "sending…");
     input.value = "";
 }
 
 function addSystemMessage(text) {
-    const container = document.getElementById("messages");
-    container.innerHTML += `<div style="text-align:center; font-size:11px; margin:15px 0; color:#cbd5e0;"><i>${text}</i></div>`;
+    addRow({ kind: "system", text: text });
+}
+
+function clearLogs() {
+    rows.length = 0;
+    pendingTurns.clear();
+    offsets = [0];
+    dirtyFrom = 0;
+    rendered = { start: 0, end: 0 };
+    stickToBottom = true;
+    resizeObserver.disconnect();
+    const list = document.getElementById("message-list");
+    list.textContent = "";
+    list.style.paddingTop = list.style.paddingBottom = "0px";
+}
+
+function handleKeyPress(e) { if (e.key === 'Enter') sendMessage(); }
+
+// 4. MESSAGE LIST
+// Rows live in `rows`; only those near the viewport have DOM nodes. The rest
+// are represented by padding on #message-list, sized from measured heights.
+const ESTIMATED_ROW_HEIGHT = 120;
+const OVERSCAN_PX = 600;
+
+const rows = [];                  // { index, kind, height, node, ...content }
+const pendingTurns = new Map();   // request_id -> row still waiting for its answer
+let offsets = [0];                // offsets[i] = top of row i; offsets[rows.length] = total height
+let dirtyFrom = 0;                // offsets from this row on are stale
+let rendered = { start: 0, end: 0 };
+let stickToBottom = true;
+let renderQueued = false;
+
+// Rows report their real height once laid out (and again as streamed text grows)
+const resizeObserver = new ResizeObserver((entries) => {
+    for (const entry of entries) {
+        const row = entry.target.row;
+        const height = entry.borderBoxSize ? entry.borderBoxSize[0].blockSize : entry.target.offsetHeight;
+        if (row && row.node === entry.target && height !== row.height) {
+            row.height = height;
+            dirtyFrom = Math.min(dirtyFrom, row.index);
+        }
+    }
+    scheduleRender();
+});
+
+document.getElementById("messages").addEventListener("scroll", (e) => {
+    const c = e.target;
+    stickToBottom = c.scrollHeight - c.scrollTop - c.clientHeight < 40;
+    scheduleRender();
+});
+
+function addRow(fields) {
+    const row = Object.assign({ index: rows.length, height: ESTIMATED_ROW_HEIGHT, node: null, isNew: true }, fields);
+    rows.push(row);
+    dirtyFrom = Math.min(dirtyFrom, row.index);
+    scheduleRender();
+    return row;
+}
+
+function addTurn(requestId, query, timestamp = "") {
+    const row = addRow({ kind: "turn", query: query, answer: "", timestamp: timestamp });
+    pendingTurns.set(requestId, row);
+    return row;
+}
+
+function appendAnswer(row, chunk) {
+    row.answer += chunk;
+    // Only the row's own text node changes; nothing else is re-parsed
+    if (row.node) row.answerText.appendData(chunk);
+}
+
+function setAnswer(row, text, timestamp) {
+    row.answer = text;
+    if (timestamp) row.timestamp = timestamp;
+    if (row.node) {
+        row.answerText.data = text;
+        row.timeEl.textContent = row.timestamp;
+    }
+}
+
+function el(tag, className, text) {
+    const node = document.createElement(tag);
+    if (className) node.className = className;
+    if (text !== undefined) node.textContent = text;
+    return node;
+}
+
+function buildRow(row) {
+    const node = el("div", "msg-row");
+    if (row.kind === "system") {
+        node.appendChild(el("div", "system-msg", row.text));
+    } else {
+        const log = el("div", row.isNew ? "log is-new" : "log");
+        row.timeEl = log.appendChild(el("div", "log-time", row.timestamp));
+        log.appendChild(el("b", "", "You: "));
+        log.appendChild(el("span", "log-query", row.query));
+        const answer = log.appendChild(el("div", "log-answer"));
+        answer.appendChild(el("b", "", "AI: "));
+        row.answerText = answer.appendChild(el("span", "answer-text")).appendChild(document.createTextNode(row.answer));
+        node.appendChild(log);
+    }
+    row.isNew = false;
+    node.row = row;
+    return node;
+}
+
+function attachRow(row) {
+    row.node = buildRow(row);
+    resizeObserver.observe(row.node);
+    return row.node;
+}
+
+function detachRow(row) {
+    resizeObserver.unobserve(row.node);
+    row.node.remove();
+    row.node = row.timeEl = row.answerText = null;
 }
 
-function clearLogs() { document.getElementById("messages").innerHTML = ""; }
-function handleKeyPress(e) { if (e.key === 'Enter') sendMessage(); }
\ No newline at end of file
+function updateOffsets() {
+    offsets.length = rows.length + 1;
+    for (let i = dirtyFrom; i < rows.length; i++) offsets[i + 1] = offsets[i] + rows[i].height;
+    dirtyFrom = rows.length;
+}
+
+// Index of the row containing y (binary search over offsets)
+function rowAt(y) {
+    let low = 0, high = rows.length - 1;
+    while (low < high) {
+        const mid = (low + high + 1) >> 1;
+        if (offsets[mid] <= y) low = mid;
+        else high = mid - 1;
+    }
+    return low;
+}
+
+function scheduleRender() {
+    if (renderQueued) return;
+    renderQueued = true;
+    requestAnimationFrame(renderRows);
+}
+
+function renderRows() {
+    renderQueued = false;
+    const container = document.getElementById("messages");
+    const list = document.getElementById("message-list");
+    updateOffsets();
+
+    const total = offsets[rows.length];
+    const viewTop = stickToBottom ? Math.max(0, total - container.clientHeight) : container.scrollTop;
+    const start = rows.length ? rowAt(viewTop - OVERSCAN_PX) : 0;
+    const end = rows.length ? rowAt(viewTop + container.clientHeight + OVERSCAN_PX) + 1 : 0;
+
+    // Drop rows that left the window, then add the ones that entered it on either side
+    for (let i = rendered.start; i < rendered.end; i++) {
+        if ((i < start || i >= end) && rows[i].node) detachRow(rows[i]);
+    }
+    const before = document.createDocumentFragment();
+    for (let i = start; i < Math.min(end, rendered.start); i++) before.appendChild(attachRow(rows[i]));
+    list.insertBefore(before, list.firstChild);
+    const after = document.createDocumentFragment();
+    for (let i = Math.max(start, rendered.end); i < end; i++) after.appendChild(attachRow(rows[i]));
+    list.appendChild(after);
+    rendered = { start: start, end: end };
+
+    list.style.paddingTop = `${offsets[start]}px`;
+    list.style.paddingBottom = `${total - offsets[end]}px`;
+    if (stickToBottom) container.scrollTop = container.scrollHeight;
+}
@@ -0,0 +1,43 @@
+# gunicorn_worker.py
+"""Uvicorn worker for gunicorn that drains chat WebSockets before shutting down.
+
+Stock uvicorn closes every WebSocket with 1012 as soon as shutdown starts,
+before the app's shutdown handlers run, which cuts off in-flight answers.
+This worker stops listening first, lets the connection manager finish
+running turns and flush conversation state, and only then hands over to
+uvicorn's normal shutdown.
+
+    gunicorn main:app --worker-class gunicorn_worker.DrainingUvicornWorker --graceful-timeout 30
+"""
+import sys
+import socket
+
+from gunicorn.arbiter import Arbiter
+from uvicorn.server import Server
+from uvicorn.workers import UvicornWorker
+
+from connection_manager import connections
+
+
+class DrainingServer(Server):
+    async def shutdown(self, sockets: list[socket.socket] | None = None) -> None:
+        # Stop accepting (uvicorn repeats this harmlessly), then drain before it drops the sockets
+        for server in self.servers:
+            server.close()
+        for sock in sockets or []:
+            sock.close()
+        if not self.force_exit:
+            # Imported lazily so loading this worker class doesn't build the store in the master
+            from state_manager import USER_CONTEXT_STORE
+            await connections.drain(flush=USER_CONTEXT_STORE.flush)
+        await super().shutdown(sockets=sockets)
+
+
+class DrainingUvicornWorker(UvicornWorker):
+    async def _serve(self) -> None:
+        self.config.app = self.wsgi
+        server = DrainingServer(config=self.config)
+        self._install_sigquit_handler()
+        await server.serve(sockets=self.sockets)
+        if not server.started:
+            sys.exit(Arbiter.WORKER_BOOT_ERROR)
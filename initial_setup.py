@@ -42,5 +42,24 @@ def add_test_user():
     finally:
         db.close()
 
+# 3. Bulk accounts for bench/load_test.py --users
+def add_users(usernames: list[str], password: str) -> int:
+    """Adds whichever of `usernames` don't exist yet; returns how many were added."""
+    db: Session = SessionLocal()
+
+    try:
+        existing = {row.username for row in db.query(User.username).filter(User.username.in_(usernames))}
+        missing = [name for name in usernames if name not in existing]
+        db.add_all(User(username=name, hashed_password=password, is_active=True) for name in missing)
+        db.commit()
+        return len(missing)
+
+    except Exception:
+        db.rollback()
+        raise
+
+    finally:
+        db.close()
+
 if __name__ == "__main__":
     add_test_user()
\ No newline at end of file
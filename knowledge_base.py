@@ -0,0 +1,207 @@
+# knowledge_base.py
+import os
+import re
+import zlib
+import fcntl
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# --- RAG Configuration ---
+RAG_INDEX_DIR = os.getenv("RAG_INDEX_DIR", "./kb_index")
+RAG_DIM = int(os.getenv("RAG_DIM", "256"))
+RAG_CHUNK_WORDS = int(os.getenv("RAG_CHUNK_WORDS", "120"))
+RAG_CHUNK_OVERLAP = int(os.getenv("RAG_CHUNK_OVERLAP", "30"))
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "4"))
+RAG_MIN_SCORE = float(os.getenv("RAG_MIN_SCORE", "0.05"))
+RAG_OPEN_INDEXES = int(os.getenv("RAG_OPEN_INDEXES", "64"))
+
+_WORD_RE = re.compile(r"\w+")
+
+# Feature weights for the hashed bag of n-grams
+WORD_WEIGHT = 1.0
+BIGRAM_WEIGHT = 1.0
+TRIGRAM_WEIGHT = 0.5
+
+
+# --- Chunking ---
+def chunk_text(text: str, chunk_words: int = RAG_CHUNK_WORDS, overlap: int = RAG_CHUNK_OVERLAP) -> list[str]:
+    """Splits text into overlapping windows of roughly `chunk_words` words."""
+    words = text.split()
+    if not words:
+        return []
+    step = max(1, chunk_words - overlap)
+    chunks = []
+    for start in range(0, len(words), step):
+        chunks.append(" ".join(words[start:start + chunk_words]))
+        if start + chunk_words >= len(words):
+            break
+    return chunks
+
+
+# --- Embeddings (local, no network) ---
+def _features(text: str) -> tuple[list[int], list[float]]:
+    """Hashes word unigrams, word bigrams and character trigrams into (bucket, signed weight) pairs."""
+    words = _WORD_RE.findall(text.lower())
+    keys, weights = [], []
+    for w in words:
+        keys.append("w:" + w)
+        weights.append(WORD_WEIGHT)
+        padded = f"#{w}#"
+        for i in range(len(padded) - 2):
+            keys.append("c:" + padded[i:i + 3])
+            weights.append(TRIGRAM_WEIGHT)
+    for a, b in zip(words, words[1:]):
+        keys.append(f"b:{a} {b}")
+        weights.append(BIGRAM_WEIGHT)
+
+    buckets, signed = [], []
+    for key, weight in zip(keys, weights):
+        # crc32 is stable across processes (unlike hash()), so every worker agrees on buckets
+        h = zlib.crc32(key.encode())
+        buckets.append(h % RAG_DIM)
+        signed.append(weight if h & 0x80000000 else -weight)
+    return buckets, signed
+
+
+def embed(texts: list[str]) -> np.ndarray:
+    """Returns L2-normalized float32 hashed n-gram vectors, one row per text."""
+    matrix = np.zeros((len(texts), RAG_DIM), dtype=np.float32)
+    for row, text in enumerate(texts):
+        buckets, signed = _features(text)
+        if buckets:
+            matrix[row] = np.bincount(buckets, weights=signed, minlength=RAG_DIM)
+    # Sublinear term frequency, then unit length so dot product == cosine
+    np.copysign(np.log1p(np.abs(matrix)), matrix, out=matrix)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
+
+
+# --- Per-user Index ---
+class UserIndex:
+    """Append-only chunk index for one user, stored as flat files and read via mmap.
+
+    vectors.f32  row-major float32 matrix (n, RAG_DIM)
+    offsets.i64  (n, 2) byte offset/length of each chunk in texts.bin
+    texts.bin    UTF-8 chunk texts, concatenated
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._vectors_path = os.path.join(directory, "vectors.f32")
+        self._offsets_path = os.path.join(directory, "offsets.i64")
+        self._texts_path = os.path.join(directory, "texts.bin")
+        self._lock_path = os.path.join(directory, ".lock")
+        self._vectors: np.ndarray | None = None
+        self._offsets: np.ndarray | None = None
+        self._texts: np.ndarray | None = None
+        self._mapped_size = -1
+        self._map_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        self._refresh()
+        return 0 if self._vectors is None else len(self._vectors)
+
+    def add(self, chunks: list[str]) -> int:
+        """Embeds and appends chunks; returns the new total chunk count."""
+        if not chunks:
+            return len(self)
+        vectors = embed(chunks)
+        encoded = [c.encode("utf-8") for c in chunks]
+
+        os.makedirs(self.directory, exist_ok=True)
+        # Workers may append to the same user's index; serialize writers across processes
+        with open(self._lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                base = os.path.getsize(self._texts_path) if os.path.exists(self._texts_path) else 0
+                offsets = np.empty((len(encoded), 2), dtype=np.int64)
+                position = base
+                for i, data in enumerate(encoded):
+                    offsets[i] = (position, len(data))
+                    position += len(data)
+                # Texts and offsets first: readers size the index by vectors.f32
+                with open(self._texts_path, "ab") as f:
+                    f.write(b"".join(encoded))
+                with open(self._offsets_path, "ab") as f:
+                    f.write(offsets.tobytes())
+                with open(self._vectors_path, "ab") as f:
+                    f.write(vectors.tobytes())
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        return len(self)
+
+    def _refresh(self):
+        """Remaps the files if another call or worker appended since the last map."""
+        try:
+            size = os.path.getsize(self._vectors_path)
+        except FileNotFoundError:
+            return
+        if size == self._mapped_size:
+            return
+        with self._map_lock:
+            if size == self._mapped_size:
+                return
+            rows = size // (RAG_DIM * 4)
+            if rows == 0:
+                return
+            self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(rows, RAG_DIM))
+            self._offsets = np.memmap(self._offsets_path, dtype=np.int64, mode="r", shape=(rows, 2))
+            self._texts = np.memmap(self._texts_path, dtype=np.uint8, mode="r")
+            self._mapped_size = size
+
+    def search(self, query_vectors: np.ndarray, k: int = RAG_TOP_K) -> list[list[tuple[float, str]]]:
+        """Batched top-k cosine search; returns (score, chunk) lists, best first, per query."""
+        self._refresh()
+        if self._vectors is None:
+            return [[] for _ in range(len(query_vectors))]
+        vectors, offsets, texts = self._vectors, self._offsets, self._texts
+
+        scores = vectors @ query_vectors.T  # (n, batch)
+        k = min(k, len(vectors))
+        top = np.argpartition(-scores, k - 1, axis=0)[:k]
+        results = []
+        for q in range(scores.shape[1]):
+            idx = top[:, q]
+            idx = idx[np.argsort(-scores[idx, q])]
+            hits = []
+            for i in idx:
+                start, length = offsets[i]
+                hits.append((float(scores[i, q]), texts[start:start + length].tobytes().decode("utf-8")))
+            results.append(hits)
+        return results
+
+
+_indexes: OrderedDict[str, UserIndex] = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_index(username: str) -> UserIndex:
+    """Returns the (cached) index for a user; directory names are hashed so usernames stay path-safe."""
+    with _indexes_lock:
+        index = _indexes.get(username)
+        if index is None:
+            key = hashlib.sha1(username.encode()).hexdigest()
+            index = _indexes[username] = UserIndex(os.path.join(RAG_INDEX_DIR, key))
+            while len(_indexes) > RAG_OPEN_INDEXES:
+                _indexes.popitem(last=False)
+        _indexes.move_to_end(username)
+        return index
+
+
+# --- Public API (blocking; call via asyncio.to_thread from async code) ---
+def add_document(username: str, text: str) -> tuple[int, int]:
+    """Chunks and indexes a document; returns (chunks added, total chunks)."""
+    chunks = chunk_text(text)
+    total = get_index(username).add(chunks)
+    return len(chunks), total
+
+
+def retrieve(username: str, query: str, k: int = RAG_TOP_K) -> list[str]:
+    """Returns up to k chunks most similar to the query, best first."""
+    hits = get_index(username).search(embed([query]), k)[0]
+    return [text for score, text in hits if score >= RAG_MIN_SCORE]
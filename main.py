@@ -1,21 +1,45 @@
 # main.py
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Query, Depends, status, HTTPException
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Query, Header, Depends, Request, status, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from pydantic import BaseModel
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import BaseModel, Field
 from datetime import datetime
+from typing import Awaitable, Callable
+import asyncio
 import json
+import logging
+import os
+import uuid
 
-from database import engine, Base, get_db
-from models import User
+from database import engine, async_engine, Base, get_async_db
+from user_cache import get_user
 from auth_handler import create_access_token, decode_access_token
 from state_manager import USER_CONTEXT_STORE
-from ai_client import get_ai_response, initialize_ai_client
+from ai_client import (
+    get_ai_response, stream_ai_response, initialize_ai_client, close_ai_client, StreamInterrupted,
+    get_cache_stats, get_scheduler_stats, get_router_stats
+)
+from context_manager import build_context, message_tokens
+from knowledge_base import add_document, retrieve
+from bulk_jobs import spool_upload, run_bulk, UploadTooLarge
+from connection_manager import connections
+from metrics import (
+    start_metrics, stop_metrics, collect, render_prometheus,
+    CHAT_TURNS, CONTEXT_MESSAGES, CONTEXT_TOKENS, LOGIN_DB
+)
+
+logger = logging.getLogger(__name__)
 
 # --- Initial Setup ---
 Base.metadata.create_all(bind=engine)
 app = FastAPI(title="Secure AI Backend")
 
+# Max concurrent turns a single WebSocket may have generating at once
+MAX_IN_FLIGHT_PER_CONNECTION = int(os.getenv("MAX_IN_FLIGHT_PER_CONNECTION", "4"))
+# Knowledge base uploads are indexed in pure Python (holding the GIL); matches the frontend's MAX_CHARS
+UPLOAD_MAX_CHARS = int(os.getenv("UPLOAD_MAX_CHARS", "10000"))
+
 # --- Schemas ---
 class LoginRequest(BaseModel):
     username: str
@@ -24,6 +48,14 @@ class LoginRequest(BaseModel):
 class TokenResponse(BaseModel):
     token: str
 
+class UploadTextRequest(BaseModel):
+    content: str = Field(max_length=UPLOAD_MAX_CHARS)
+
+class UploadTextResponse(BaseModel):
+    status: str
+    chunks_added: int
+    total_chunks: int
+
 # --- CORS ---
 app.add_middleware(
     CORSMiddleware,
@@ -37,6 +69,17 @@ app.add_middleware(
 @app.on_event("startup")
 async def startup_event():
     await initialize_ai_client()
+    await USER_CONTEXT_STORE.start()
+    start_metrics()
+    connections.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    connections.stop()
+    await USER_CONTEXT_STORE.close()
+    await close_ai_client()
+    await async_engine.dispose()
+    stop_metrics()
 
 # --- Auth Dependencies ---
 async def get_current_user_from_token(websocket: WebSocket, token: str = Query(...)):
@@ -46,10 +89,21 @@ async def get_current_user_from_token(websocket: WebSocket, token: str = Query(.
         return None
     return username
 
+async def get_current_user_from_header(authorization: str = Header(...)) -> str:
+    scheme, _, token = authorization.partition(" ")
+    username = decode_access_token(token) if scheme.lower() == "bearer" else None
+    if username is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired token"
+        )
+    return username
+
 # --- REST API (Login Endpoint) ---
 @app.post("/api/v1/auth/login", response_model=TokenResponse)
-async def login(credentials: LoginRequest, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == credentials.username).first()
+async def login(credentials: LoginRequest, db: AsyncSession = Depends(get_async_db)):
+    with LOGIN_DB.time():
+        user = await get_user(db, credentials.username)
     if user is None or user.hashed_password != credentials.password:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -58,6 +112,179 @@ async def login(credentials: LoginRequest, db: Session = Depends(get_db)):
     token = create_access_token(user_id=user.username)
     return TokenResponse(token=token)
 
+# --- REST API (Knowledge Base Upload) ---
+@app.post("/api/v1/essays/upload-text", response_model=UploadTextResponse)
+async def upload_text(request: UploadTextRequest, username: str = Depends(get_current_user_from_header)):
+    content = request.content.strip()
+    if not content:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Text is empty"
+        )
+    # Chunking + embedding is CPU work; keep it off the event loop
+    added, total = await asyncio.to_thread(add_document, username, content)
+    return UploadTextResponse(status="ok", chunks_added=added, total_chunks=total)
+
+# --- REST API (Bulk Questions, JSONL in / NDJSON out) ---
+@app.post("/api/v1/ai/bulk")
+async def bulk_questions(request: Request, username: str = Depends(get_current_user_from_header)):
+    try:
+        spool = await spool_upload(request)
+    except UploadTooLarge as e:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=str(e)
+        )
+    return StreamingResponse(run_bulk(username, spool), media_type="application/x-ndjson")
+
+# --- REST API (AI Stats) ---
+@app.get("/api/v1/ai/stats")
+async def ai_stats():
+    return {"cache": get_cache_stats(), "scheduler": get_scheduler_stats(), "routes": get_router_stats()}
+
+# --- Metrics (Prometheus text, aggregated across workers) ---
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    body = await asyncio.to_thread(render_prometheus, collect())
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+# --- WebSocket Turn Handling ---
+def _resolve_after(previous: asyncio.Future | None, done: asyncio.Future):
+    """Marks `done` once `previous` has resolved, keeping commits in receipt order."""
+    def _set(_=None):
+        if not done.done():
+            done.set_result(None)
+    if previous is None or previous.done():
+        _set()
+    else:
+        previous.add_done_callback(_set)
+
+async def run_turn(
+    send: Callable[[dict], Awaitable[None]],
+    username: str,
+    request_id: str,
+    payload: dict,
+    previous_commit: asyncio.Future | None,
+    commit: asyncio.Future,
+):
+    """Answers one question; memory is updated in the order questions were received."""
+    mode = "stream" if payload.get("stream") else "complete"
+    answered = False
+    try:
+        question_text = payload.get("data", "").strip()
+
+        # 2. Build the turn's context (memory is only updated once the answer is complete)
+        user_message = {"role": "user", "content": question_text}
+        # The LRU may have evicted this user mid-session; reload rather than answer without memory
+        if not USER_CONTEXT_STORE.cached(username):
+            await USER_CONTEXT_STORE.load(username)
+        history = USER_CONTEXT_STORE.get(username) + [user_message]
+        # Recent turns verbatim + running summary of older ones, within the token budget
+        context = build_context(username, history)
+        CONTEXT_MESSAGES.observe(len(context))
+        CONTEXT_TOKENS.observe(sum(message_tokens(m) for m in context))
+        # RAG mode: ground the answer in the user's uploaded knowledge base
+        knowledge = None
+        if payload.get("mode") == "rag":
+            knowledge = await asyncio.to_thread(retrieve, username, question_text)
+
+        # 3. Get AI Response (Passing bounded context for memory)
+        interrupted = False
+        if payload.get("stream"):
+            # Forward tokens as they arrive so the client sees the first token ASAP
+            chunks = []
+            try:
+                async for chunk in stream_ai_response(
+                    username=username,
+                    context_history=context,
+                    knowledge=knowledge,
+                    fresh=bool(payload.get("fresh"))
+                ):
+                    chunks.append(chunk)
+                    await send({
+                        "type": "ai_chunk",
+                        "request_id": request_id,
+                        "query": question_text,
+                        "data": chunk,
+                        "status": "streaming"
+                    })
+                ai_response = "".join(chunks)
+            except StreamInterrupted as e:
+                # The client saw a partial answer; replace it with the error and don't remember it
+                ai_response, interrupted = str(e), True
+        else:
+            ai_response = await get_ai_response(
+                username=username,
+                context_history=context,
+                knowledge=knowledge,
+                fresh=bool(payload.get("fresh"))
+            )
+
+        failed = interrupted or ai_response.startswith(("AI Error", "ERROR"))
+        CHAT_TURNS.inc(mode=mode, outcome="error" if failed else "ok")
+        answered = True
+
+        # 4. Update Memory (User + AI Side) once every earlier turn has committed. A callback,
+        # so neither a cancel nor a failed send after the answer is ready can drop it
+        def _remember(_=None):
+            if commit.done():
+                return
+            if not interrupted:
+                USER_CONTEXT_STORE.append(username, user_message)
+                USER_CONTEXT_STORE.append(username, {"role": "ai", "content": ai_response})
+            commit.set_result(None)
+
+        if previous_commit is None or previous_commit.done():
+            _remember()
+        else:
+            previous_commit.add_done_callback(_remember)
+
+        # 5. Send Structured Log Data (Task requirement: Timestamp + Q + A) as soon as it's
+        # ready; responses carry request_id, so only the memory writes wait for earlier turns
+        await send({
+            "type": "ai_response",
+            "request_id": request_id,
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "query": question_text,
+            "data": ai_response,
+            "status": "complete"
+        })
+
+        if not commit.done():
+            # Stay in flight until the write lands so a drain flushes it
+            await asyncio.shield(commit)
+    except asyncio.CancelledError:
+        if not answered:
+            CHAT_TURNS.inc(mode=mode, outcome="cancelled")
+        raise
+    except Exception as e:
+        if not answered:
+            CHAT_TURNS.inc(mode=mode, outcome="failed")
+        logger.warning("❌ Error in turn %s: %s", request_id, e)
+
+def start_turn(
+    in_flight: dict[str, asyncio.Task],
+    send: Callable[[dict], Awaitable[None]],
+    username: str,
+    request_id: str,
+    payload: dict,
+    previous_commit: asyncio.Future | None,
+) -> asyncio.Future:
+    """Runs a turn as a task tracked in `in_flight`; returns its commit future."""
+    commit = asyncio.get_running_loop().create_future()
+    task = asyncio.create_task(run_turn(send, username, request_id, payload, previous_commit, commit))
+    in_flight[request_id] = task
+
+    def _done(t: asyncio.Task):
+        if in_flight.get(request_id) is t:
+            in_flight.pop(request_id)
+        # Cancelled or failed turns commit nothing but must not stall later ones. This runs
+        # outside run_turn so a turn cancelled before its first step still releases the chain.
+        _resolve_after(previous_commit, commit)
+
+    task.add_done_callback(_done)
+    return commit
+
 # --- WebSocket Endpoint ---
 @app.websocket("/api/v1/ai/chat")
 async def websocket_endpoint(
@@ -70,43 +297,63 @@ async def websocket_endpoint(
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
         return
 
-    await websocket.accept()
-    
-    # Requirement: AI Memory initialization
-    if username not in USER_CONTEXT_STORE:
-        USER_CONTEXT_STORE[username] = []
+    # Over the per-worker cap or draining: accept so the client gets a real close code
+    rejection = connections.rejection()
+    if rejection is not None:
+        code, reason = rejection
+        await websocket.accept()
+        await websocket.close(code=code, reason=reason)
+        return
 
-    print(f"🟢 {username} connected")
+    conn = connections.register(websocket, username)
+    in_flight = conn.in_flight
+    send = conn.send
+    last_commit: asyncio.Future | None = None
 
     try:
+        await websocket.accept()
+
+        # Requirement: AI Memory initialization (lazy-loads history written by any worker)
+        await USER_CONTEXT_STORE.load(username)
+        logger.debug("🟢 %s connected", username)
+
         while True:
             # 1. Receive data
             data = await websocket.receive_text()
             payload = json.loads(data)
-            question_text = payload.get("data", "").strip()
-
-            # 2. Update Memory (User Side)
-            USER_CONTEXT_STORE[username].append({"role": "user", "content": question_text})
+            # Heartbeat replies keep the socket alive but don't count as activity
+            conn.touch(active=payload.get("type") != "pong")
+            if payload.get("type") == "pong":
+                continue
+            request_id = str(payload.get("request_id") or uuid.uuid4().hex)
 
-            # 3. Get AI Response (Passing full history for memory)
-            ai_response = await get_ai_response(
-                username=username,
-                context_history=USER_CONTEXT_STORE[username]
-            )
+            if payload.get("type") == "cancel":
+                # Abort the upstream call and free the slot right away
+                task = in_flight.pop(request_id, None)
+                if task is not None:
+                    task.cancel()
+                await send({"type": "cancelled", "request_id": request_id, "status": "cancelled"})
+                continue
 
-            # 4. Update Memory (AI Side)
-            USER_CONTEXT_STORE[username].append({"role": "ai", "content": ai_response})
+            if connections.draining or request_id in in_flight or len(in_flight) >= MAX_IN_FLIGHT_PER_CONNECTION:
+                if connections.draining:
+                    reason = "Server is restarting; please retry shortly."
+                elif request_id in in_flight:
+                    reason = "Duplicate request_id."
+                else:
+                    reason = f"Too many requests in flight (max {MAX_IN_FLIGHT_PER_CONNECTION})."
+                await send({"type": "error", "request_id": request_id, "data": reason, "status": "rejected"})
+                continue
 
-            # 5. Send Structured Log Data (Task requirement: Timestamp + Q + A)
-            await websocket.send_json({
-                "type": "ai_response",
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "query": question_text,
-                "data": ai_response,
-                "status": "complete"
-            })
+            last_commit = start_turn(in_flight, send, username, request_id, payload, last_commit)
 
     except WebSocketDisconnect:
-        print(f"🔌 {username} disconnected.")
+        logger.debug("🔌 %s disconnected.", username)
     except Exception as e:
-        print(f"❌ Error: {e}")
\ No newline at end of file
+        logger.warning("❌ Error: %s", e)
+    finally:
+        connections.unregister(conn)
+        for task in in_flight.values():
+            task.cancel()
+        # Persist now so a reconnect to another worker sees this session
+        await USER_CONTEXT_STORE.flush()
@@ -0,0 +1,287 @@
+# metrics.py
+"""Low-overhead counters, gauges and histograms exposed in Prometheus text format.
+
+Recording is a dict update on the event loop thread (no locks, no I/O). Each
+worker periodically writes a JSON snapshot to METRICS_DIR; /metrics merges the
+snapshots of every worker so the numbers cover the whole gunicorn pool:
+counters and histograms are summed (dead workers' totals are kept), gauges
+are summed or max'ed across live workers only.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from bisect import bisect_left
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+METRICS_DIR = os.getenv("METRICS_DIR", "/tmp/ai_backend_metrics")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "2"))
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5)
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+
+def _label_key(labelnames: tuple[str, ...], labels: dict) -> tuple[str, ...]:
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        _registry[name] = self
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, help, labelnames)
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(self.labelnames, labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def snapshot(self) -> dict:
+        return {"|".join(k): v for k, v in self.values.items()}
+
+
+class Gauge(_Metric):
+    """`aggregate` is how live workers combine: "sum" or "max"."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (),
+                 aggregate: str = "sum", callback: Callable[[], float] | None = None):
+        super().__init__(name, help, labelnames)
+        self.aggregate = aggregate
+        self.callback = callback
+        self.values: dict[tuple, float] = {}
+
+    def set(self, value: float, **labels):
+        self.values[_label_key(self.labelnames, labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(self.labelnames, labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def snapshot(self) -> dict:
+        if self.callback is not None:
+            self.set(self.callback())
+        return {"|".join(k): v for k, v in self.values.items()}
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label key -> [per-bucket counts..., +Inf count, sum]
+        self.values: dict[tuple, list[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        series = self.values.get(key)
+        if series is None:
+            series = self.values[key] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def time(self, **labels) -> "_Timer":
+        return _Timer(self, labels)
+
+    def snapshot(self) -> dict:
+        return {"|".join(k): list(v) for k, v in self.values.items()}
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+_registry: dict[str, _Metric] = {}
+
+
+# --- Application Metrics ---
+WS_ACTIVE_CONNECTIONS = Gauge("ws_active_connections", "Open chat WebSockets.")
+WS_SERVER_CLOSES = Counter(
+    "ws_server_closes_total", "WebSockets rejected or closed by the server, by reason.", ("reason",)
+)
+CHAT_TURNS = Counter("chat_turns_total", "Chat turns by mode and outcome.", ("mode", "outcome"))
+UPSTREAM_LATENCY = Histogram(
+    "upstream_request_duration_seconds", "Groq request latency (to headers for streams) by route and status.",
+    ("route", "status")
+)
+BULK_PROMPTS = Counter("bulk_prompts_total", "Bulk API prompts by outcome.", ("outcome",))
+CONTEXT_MESSAGES = Histogram("context_messages", "Messages sent upstream per turn.", buckets=SIZE_BUCKETS)
+CONTEXT_TOKENS = Histogram("context_tokens", "Estimated context tokens sent upstream per turn.", buckets=TOKEN_BUCKETS)
+JWT_DECODE = Histogram("jwt_decode_duration_seconds", "JWT decode/verify time.", buckets=FAST_BUCKETS)
+LOGIN_DB = Histogram("login_db_duration_seconds", "User lookup time during login.", buckets=FAST_BUCKETS)
+EVENT_LOOP_LAG = Histogram("event_loop_lag_seconds", "Event loop scheduling delay.", buckets=FAST_BUCKETS)
+
+
+# --- Worker Snapshots ---
+def _snapshot_path(pid: int) -> str:
+    return os.path.join(METRICS_DIR, f"worker-{pid}.json")
+
+
+def collect() -> dict:
+    """This worker's current values; call on the event loop thread (metrics aren't locked)."""
+    return {
+        "pid": os.getpid(),
+        "metrics": {name: metric.snapshot() for name, metric in _registry.items()},
+    }
+
+
+def write_snapshot(data: dict):
+    """Atomically writes a collect() result for /metrics readers in any worker."""
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    tmp = _snapshot_path(os.getpid()) + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(tmp, _snapshot_path(os.getpid()))
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _read_snapshots() -> list[dict]:
+    snapshots = []
+    try:
+        names = os.listdir(METRICS_DIR)
+    except FileNotFoundError:
+        return snapshots
+    for name in names:
+        if not (name.startswith("worker-") and name.endswith(".json")):
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, name)) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        snapshot["alive"] = _pid_alive(snapshot["pid"])
+        snapshots.append(snapshot)
+    return snapshots
+
+
+def _format_labels(labelnames: tuple[str, ...], key: str, extra: str = "") -> str:
+    values = key.split("|") if labelnames else []
+    parts = [f'{n}="{v}"' for n, v in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def render_prometheus(own: dict) -> str:
+    """Writes our own snapshot, then merges every worker's into Prometheus text format.
+
+    Does file I/O; run it in a thread with `own` collected on the loop.
+    """
+    write_snapshot(own)
+    snapshots = _read_snapshots()
+    lines = []
+    for name, metric in _registry.items():
+        merged: dict = {}
+        for snapshot in snapshots:
+            series = snapshot["metrics"].get(name, {})
+            if metric.kind == "gauge":
+                if not snapshot["alive"]:
+                    continue
+                for key, value in series.items():
+                    if key not in merged:
+                        merged[key] = value
+                    elif metric.aggregate == "max":
+                        merged[key] = max(merged[key], value)
+                    else:
+                        merged[key] += value
+            elif metric.kind == "counter":
+                for key, value in series.items():
+                    merged[key] = merged.get(key, 0) + value
+            else:
+                for key, values in series.items():
+                    if key in merged:
+                        merged[key] = [a + b for a, b in zip(merged[key], values)]
+                    else:
+                        merged[key] = list(values)
+
+        lines.append(f"# HELP {name} {metric.help}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        for key, value in merged.items():
+            if metric.kind != "histogram":
+                lines.append(f"{name}{_format_labels(metric.labelnames, key)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets + (float("inf"),), value[:-1]):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f"{name}_bucket{_format_labels(metric.labelnames, key, le)} {cumulative}")
+            lines.append(f"{name}_count{_format_labels(metric.labelnames, key)} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(metric.labelnames, key)} {value[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+# --- Background Tasks ---
+async def _flush_loop():
+    while True:
+        await asyncio.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            await asyncio.to_thread(write_snapshot, collect())
+        except Exception as e:
+            logger.warning("Metrics snapshot failed: %s", e)
+
+
+async def _loop_lag_monitor():
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - started - LOOP_LAG_INTERVAL))
+
+
+_tasks: list[asyncio.Task] = []
+
+
+def start_metrics():
+    if not _tasks:
+        _tasks.append(asyncio.create_task(_flush_loop()))
+        _tasks.append(asyncio.create_task(_loop_lag_monitor()))
+
+
+def stop_metrics():
+    """Stops background tasks and leaves a final snapshot so our counters survive us."""
+    while _tasks:
+        _tasks.pop().cancel()
+    try:
+        write_snapshot(collect())
+    except OSError as e:
+        logger.warning("Final metrics snapshot failed: %s", e)
@@ -0,0 +1,274 @@
+# model_router.py
+"""Routes upstream calls across endpoints/models with hedging, fallback and circuit breaking.
+
+The router doesn't talk HTTP itself: callers hand it an `attempt(route)`
+coroutine factory and it decides which routes to try, when to fire a hedge,
+and which result wins.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable, TypeVar
+
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# --- Router Configuration ---
+ROUTER_HEDGE_ENABLED = os.getenv("ROUTER_HEDGE_ENABLED", "true").lower() == "true"
+ROUTER_HEDGE_PERCENTILE = float(os.getenv("ROUTER_HEDGE_PERCENTILE", "95"))
+ROUTER_HEDGE_MIN_DELAY = float(os.getenv("ROUTER_HEDGE_MIN_DELAY", "0.5"))
+ROUTER_HEDGE_MAX_DELAY = float(os.getenv("ROUTER_HEDGE_MAX_DELAY", "8"))
+ROUTER_HEDGE_DEFAULT_DELAY = float(os.getenv("ROUTER_HEDGE_DEFAULT_DELAY", "4"))
+ROUTER_LATENCY_WINDOW = int(os.getenv("ROUTER_LATENCY_WINDOW", "200"))
+ROUTER_LATENCY_MIN_SAMPLES = int(os.getenv("ROUTER_LATENCY_MIN_SAMPLES", "20"))
+ROUTER_SHORT_PROMPT_TOKENS = int(os.getenv("ROUTER_SHORT_PROMPT_TOKENS", "200"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))
+
+ROUTE_EVENTS = Counter(
+    "upstream_route_events_total", "Hedges, hedge wins, fallbacks and breaker trips by route.", ("route", "event")
+)
+
+
+@dataclass
+class Route:
+    """One upstream endpoint/model pair."""
+    name: str
+    url: str
+    model: str
+    api_key_env: str = "GROQ_API_KEY"
+    # Preferred for prompts under ROUTER_SHORT_PROMPT_TOKENS
+    short_prompts: bool = False
+
+    @property
+    def api_key(self) -> str | None:
+        return os.getenv(self.api_key_env)
+
+
+def load_routes(default_url: str, default_model: str) -> list[Route]:
+    """Routes from GROQ_ROUTES (JSON list of Route fields), else the default model
+    plus an optional GROQ_FAST_MODEL for short prompts."""
+    raw = os.getenv("GROQ_ROUTES")
+    if raw:
+        return [Route(**{"url": default_url, **entry}) for entry in json.loads(raw)]
+    routes = [Route(name="primary", url=default_url, model=default_model)]
+    fast_model = os.getenv("GROQ_FAST_MODEL")
+    if fast_model:
+        routes.append(Route(name="fast", url=default_url, model=fast_model, short_prompts=True))
+    return routes
+
+
+class CircuitBreaker:
+    """Opens after consecutive failures; after a cooldown lets one trial call through."""
+
+    def __init__(self, threshold: int = BREAKER_FAILURE_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial_running:
+            self._trial_running = True
+            return True
+        return False
+
+    def release_trial(self):
+        """The half-open trial ended without telling us anything (cancelled / client error)."""
+        self._trial_running = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    def record_failure(self) -> bool:
+        """Returns True if this failure tripped the breaker."""
+        self.failures += 1
+        was_closed = self.opened_at is None
+        if self._trial_running or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+            self._trial_running = False
+            return was_closed
+        return False
+
+
+class LatencyTracker:
+    """Sliding window of successful call latencies."""
+
+    def __init__(self, window: int = ROUTER_LATENCY_WINDOW):
+        self.samples: deque[float] = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, pct: float) -> float | None:
+        if len(self.samples) < ROUTER_LATENCY_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class ModelRouter:
+    def __init__(self, routes: list[Route]):
+        self.routes = routes
+        self.breakers = {route.name: CircuitBreaker() for route in routes}
+        # Streams are tracked separately: their latency is time-to-headers, not full generation
+        self.latency = {(route.name, stream): LatencyTracker() for route in routes for stream in (False, True)}
+        # Monotonic deadline until which a route's caller is sleeping off a 429/5xx
+        self.backoff_until = {route.name: 0.0 for route in routes}
+
+    def plan(self, prompt_tokens: int) -> list[Route]:
+        """Routes to try, best first: short prompts prefer fast routes; open breakers go last."""
+        short = prompt_tokens <= ROUTER_SHORT_PROMPT_TOKENS
+        ordered = sorted(self.routes, key=lambda r: 0 if r.short_prompts == short else 1)
+        healthy = [r for r in ordered if self.breakers[r.name].state != "open"]
+        # Every breaker open: the first route's breaker fails fast until its half-open trial
+        return healthy or ordered[:1]
+
+    def hedge_delay(self, route: Route, stream: bool) -> float:
+        observed = self.latency[(route.name, stream)].percentile(ROUTER_HEDGE_PERCENTILE)
+        if observed is None:
+            return ROUTER_HEDGE_DEFAULT_DELAY
+        return min(ROUTER_HEDGE_MAX_DELAY, max(ROUTER_HEDGE_MIN_DELAY, observed))
+
+    def backing_off(self, route: Route, seconds: float):
+        """Called by the retry loop before it sleeps; no hedge fires to the route meanwhile."""
+        self.backoff_until[route.name] = max(self.backoff_until[route.name], time.monotonic() + seconds)
+
+    def _in_backoff(self, route: Route) -> bool:
+        return time.monotonic() < self.backoff_until[route.name]
+
+    async def _tracked(self, route: Route, stream: bool, attempt: Callable[[Route], Awaitable[T]],
+                       is_failure: Callable[[BaseException], bool]) -> T:
+        breaker = self.breakers[route.name]
+        if not breaker.allow():
+            raise CircuitOpen(route.name)
+        started = time.monotonic()
+        try:
+            result = await attempt(route)
+        except asyncio.CancelledError:
+            # Losing a hedge race says nothing about the route's health
+            breaker.release_trial()
+            raise
+        except Exception as e:
+            if not is_failure(e):
+                breaker.release_trial()
+            elif breaker.record_failure():
+                ROUTE_EVENTS.inc(route=route.name, event="circuit_open")
+                logger.warning("⚠️ Circuit opened for route %s: %s", route.name, e)
+            raise
+        breaker.record_success()
+        self.latency[(route.name, stream)].record(time.monotonic() - started)
+        return result
+
+    async def call(
+        self,
+        prompt_tokens: int,
+        attempt: Callable[[Route], Awaitable[T]],
+        *,
+        stream: bool = False,
+        is_failure: Callable[[BaseException], bool] = lambda e: True,
+        discard: Callable[[T], Awaitable[None]] | None = None,
+    ) -> T:
+        """Runs `attempt` on the planned routes and returns the first success.
+
+        If the first attempt is slower than its route's latency percentile, a
+        hedge is fired on the next route (or the same one if it's the only
+        one), unless that route is backing off. Failures that `is_failure`
+        counts (or an open breaker) fall back to the next route; anything
+        else is raised. Losing attempts are cancelled, and `discard` releases
+        results that finished too late.
+        """
+        plan = self.plan(prompt_tokens)
+        primary = plan[0]
+        remaining = plan[1:]
+        pending: dict[asyncio.Task, Route] = {}
+        last_error: BaseException | None = None
+
+        def launch(route: Route) -> asyncio.Task:
+            task = asyncio.create_task(self._tracked(route, stream, attempt, is_failure))
+            pending[task] = route
+            return task
+
+        first = launch(primary)
+        hedge_armed, hedged = ROUTER_HEDGE_ENABLED, False
+        try:
+            while pending:
+                timeout = self.hedge_delay(primary, stream) if hedge_armed else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    hedge_armed = False
+                    route = remaining[0] if remaining else primary
+                    if self._in_backoff(route):
+                        # It just asked us to wait (429/5xx); a hedge would only add to the pile
+                        ROUTE_EVENTS.inc(route=route.name, event="hedge_skipped")
+                        continue
+                    # Slower than this route usually is: race a backup request
+                    hedged = True
+                    if remaining:
+                        remaining.pop(0)
+                    ROUTE_EVENTS.inc(route=route.name, event="hedge")
+                    launch(route)
+                    continue
+
+                for task in done:
+                    route = pending.pop(task)
+                    if task.exception() is None:
+                        if task is not first:
+                            ROUTE_EVENTS.inc(route=route.name, event="hedge_won" if hedged else "fallback_won")
+                        return task.result()
+                    last_error = task.exception()
+
+                if not pending:
+                    # A client error (4xx) would fail the same way on every route
+                    if not remaining or not (isinstance(last_error, CircuitOpen) or is_failure(last_error)):
+                        break
+                    route = remaining.pop(0)
+                    ROUTE_EVENTS.inc(route=route.name, event="fallback")
+                    launch(route)
+            raise last_error
+        finally:
+            # Cancel the losers; one may already have finished, so release what it holds
+            for task in pending:
+                task.cancel()
+            if pending:
+                for result in await asyncio.gather(*pending, return_exceptions=True):
+                    if discard is not None and not isinstance(result, BaseException):
+                        await discard(result)
+
+    def stats(self) -> dict:
+        return {
+            route.name: {
+                "model": route.model,
+                "circuit": self.breakers[route.name].state,
+                "consecutive_failures": self.breakers[route.name].failures,
+                "hedge_delay_s": round(self.hedge_delay(route, False), 3),
+                "stream_hedge_delay_s": round(self.hedge_delay(route, True), 3),
+            }
+            for route in self.routes
+        }
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling a route whose breaker is open."""
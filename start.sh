@@ -1,5 +1,11 @@
 # start.sh
 
 #!/usr/bin/env bash
+# Workers share metrics through snapshot files; start each deploy from zero
+export METRICS_DIR="${METRICS_DIR:-/tmp/ai_backend_metrics}"
+rm -rf "$METRICS_DIR"
+
 # Explicitly use the virtual environment's python executable
-/opt/render/project/src/.venv/bin/gunicorn main:app --workers 4 --worker-class uvicorn.workers.UvicornWorker --bind 0.0.0.0:$PORT
\ No newline at end of file
+# The draining worker finishes in-flight chat turns (DRAIN_TIMEOUT, 20s) within the graceful timeout
+/opt/render/project/src/.venv/bin/gunicorn main:app --workers 4 --worker-class gunicorn_worker.DrainingUvicornWorker \
+    --graceful-timeout 30 --bind 0.0.0.0:$PORT
\ No newline at end of file
@@ -1 +1,338 @@
-USER_CONTEXT_STORE = {}
\ No newline at end of file
+# state_manager.py
+import os
+import time
+import asyncio
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+# --- Store Configuration ---
+# "sqlite" shares conversations across gunicorn workers; "memory" is per-process only
+CONVERSATION_STORE = os.getenv("CONVERSATION_STORE", "sqlite")
+CONVERSATION_DB_PATH = os.getenv("CONVERSATION_DB_PATH", "./conversations.db")
+MAX_MESSAGES_PER_USER = int(os.getenv("MAX_MESSAGES_PER_USER", "200"))
+MAX_BYTES_PER_USER = int(os.getenv("MAX_BYTES_PER_USER", str(256 * 1024)))
+MAX_TOTAL_BYTES = int(os.getenv("MAX_TOTAL_BYTES", str(64 * 1024 * 1024)))
+FLUSH_INTERVAL_SECONDS = float(os.getenv("STORE_FLUSH_INTERVAL", "0.5"))
+FLUSH_BATCH_SIZE = int(os.getenv("STORE_FLUSH_BATCH_SIZE", "256"))
+
+# Rough per-message bookkeeping cost on top of the text itself
+MESSAGE_OVERHEAD_BYTES = 64
+
+
+def _message_size(message: dict) -> int:
+    return len(message["content"]) + MESSAGE_OVERHEAD_BYTES
+
+
+class Summary(NamedTuple):
+    """Running summary of a user's oldest turns, covering every message with seq < `through`."""
+    text: str
+    through: int
+
+
+class ConversationStore:
+    """Interface for per-user conversation history.
+
+    Stored messages get a "seq": their position in the user's whole history,
+    which stays stable as old messages are trimmed or reloaded.
+
+    get/append/cached and the summary accessors are synchronous and never
+    touch disk, so they are safe to call on every turn. load/flush/close may
+    do I/O and are awaited at connection and process boundaries, or when
+    cached() says the user has to be reloaded.
+    """
+
+    async def start(self):
+        pass
+
+    async def load(self, username: str) -> list[dict]:
+        """Called on connect; makes the user's history available to get()."""
+        return self.get(username)
+
+    def get(self, username: str) -> list[dict]:
+        """Returns the user's history, oldest first. Treat as read-only."""
+        raise NotImplementedError
+
+    def append(self, username: str, message: dict):
+        raise NotImplementedError
+
+    def cached(self, username: str) -> bool:
+        """False if the user's history must be load()ed before get() is accurate."""
+        return True
+
+    def get_summary(self, username: str) -> Summary | None:
+        return None
+
+    def set_summary(self, username: str, summary: Summary):
+        pass
+
+    async def flush(self):
+        pass
+
+    async def close(self):
+        await self.flush()
+
+
+class MemoryConversationStore(ConversationStore):
+    """In-process LRU store with per-user and global memory caps."""
+
+    def __init__(self, max_messages_per_user: int = MAX_MESSAGES_PER_USER,
+                 max_bytes_per_user: int = MAX_BYTES_PER_USER,
+                 max_total_bytes: int = MAX_TOTAL_BYTES):
+        self.max_messages_per_user = max_messages_per_user
+        self.max_bytes_per_user = max_bytes_per_user
+        self.max_total_bytes = max_total_bytes
+        self._histories: OrderedDict[str, list[dict]] = OrderedDict()
+        self._sizes: dict[str, int] = {}
+        self._next_seq: dict[str, int] = {}
+        self._summaries: dict[str, Summary] = {}
+        self._total_bytes = 0
+
+    def get(self, username: str) -> list[dict]:
+        history = self._histories.get(username)
+        if history is None:
+            return []
+        self._histories.move_to_end(username)
+        return history
+
+    def append(self, username: str, message: dict):
+        history = self._histories.get(username)
+        if history is None:
+            history = self._set(username, [])
+        self._histories.move_to_end(username)
+        message["seq"] = self._next_seq[username]
+        self._next_seq[username] += 1
+        history.append(message)
+        size = _message_size(message)
+        self._sizes[username] += size
+        self._total_bytes += size
+        self._trim(username)
+        self._evict()
+
+    def cached(self, username: str) -> bool:
+        return username in self._histories
+
+    def get_summary(self, username: str) -> Summary | None:
+        return self._summaries.get(username)
+
+    def set_summary(self, username: str, summary: Summary):
+        # An evicted user's summary goes with their history
+        if username in self._histories:
+            self._summaries[username] = summary
+
+    def _set(self, username: str, history: list[dict]) -> list[dict]:
+        """Replaces the user's cached history (and summary); messages must carry seq."""
+        self._drop(username)
+        self._histories[username] = history
+        self._next_seq[username] = history[-1]["seq"] + 1 if history else 0
+        self._sizes[username] = sum(_message_size(m) for m in history)
+        self._total_bytes += self._sizes[username]
+        self._trim(username)
+        self._evict()
+        return history
+
+    def _drop(self, username: str):
+        if username in self._histories:
+            del self._histories[username]
+            del self._next_seq[username]
+            self._summaries.pop(username, None)
+            self._total_bytes -= self._sizes.pop(username)
+
+    def _trim(self, username: str):
+        """Drops the user's oldest messages beyond the per-user caps (keeps the newest one)."""
+        history = self._histories[username]
+        while len(history) > 1 and (
+            len(history) > self.max_messages_per_user
+            or self._sizes[username] > self.max_bytes_per_user
+        ):
+            size = _message_size(history.pop(0))
+            self._sizes[username] -= size
+            self._total_bytes -= size
+
+    def _evict(self):
+        """Evicts least recently used users until under the global cap (never the newest)."""
+        while self._total_bytes > self.max_total_bytes and len(self._histories) > 1:
+            username = next(iter(self._histories))
+            self._drop(username)
+
+
+class SQLiteConversationStore(MemoryConversationStore):
+    """Persistent store shared by all workers through a WAL-mode SQLite file.
+
+    The in-process LRU acts as a cache: history is loaded lazily when a user
+    connects (or is needed again after eviction) and appends and summaries are
+    written behind in batches by a background task.
+    """
+
+    def __init__(self, path: str = CONVERSATION_DB_PATH, **limits):
+        super().__init__(**limits)
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+        self._db_lock = threading.Lock()
+        self._pending: list[tuple] = []
+        self._pending_summaries: dict[str, Summary] = {}
+        # Writes per user seen while a load() of that user is running
+        self._writes_during_load: dict[str, int] = {}
+        self._loads: dict[str, int] = {}
+        self._flusher: asyncio.Task | None = None
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS conversation_messages ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " username TEXT NOT NULL,"
+            " role TEXT NOT NULL,"
+            " content TEXT NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_conversation_messages_username"
+            " ON conversation_messages (username, id)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS conversation_summaries ("
+            " username TEXT PRIMARY KEY,"
+            " summary TEXT NOT NULL,"
+            " through INTEGER NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        conn.commit()
+        return conn
+
+    async def start(self):
+        if self._conn is None:
+            self._conn = await asyncio.to_thread(self._connect)
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def load(self, username: str) -> list[dict]:
+        self._loads[username] = self._loads.get(username, 0) + 1
+        self._writes_during_load.setdefault(username, 0)
+        try:
+            while True:
+                # Our own pending writes must land first so the reload sees them; a write
+                # that arrives meanwhile may or may not be in what we read, so read again
+                writes = self._writes_during_load[username]
+                await self.flush()
+                history, summary = await asyncio.to_thread(self._read, username)
+                if self._writes_during_load[username] == writes:
+                    break
+        finally:
+            self._loads[username] -= 1
+            if not self._loads[username]:
+                del self._loads[username], self._writes_during_load[username]
+        self._set(username, history)
+        if summary is not None:
+            self._summaries[username] = summary
+        return history
+
+    def _read(self, username: str) -> tuple[list[dict], Summary | None]:
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT role, content FROM conversation_messages"
+                " WHERE username = ? ORDER BY id DESC LIMIT ?",
+                (username, self.max_messages_per_user),
+            ).fetchall()
+            total = self._conn.execute(
+                "SELECT COUNT(*) FROM conversation_messages WHERE username = ?", (username,)
+            ).fetchone()[0]
+            summary = self._conn.execute(
+                "SELECT summary, through FROM conversation_summaries WHERE username = ?", (username,)
+            ).fetchone()
+        first = total - len(rows)
+        history = [
+            {"role": role, "content": content, "seq": first + i}
+            for i, (role, content) in enumerate(reversed(rows))
+        ]
+        return history, Summary(*summary) if summary else None
+
+    def append(self, username: str, message: dict):
+        # Evicted users aren't re-cached from a partial history; the write still
+        # lands and the next load() (see cached()) picks it up
+        if username in self._histories:
+            super().append(username, message)
+        self._pending.append((username, message["role"], message["content"], time.time()))
+        if username in self._writes_during_load:
+            self._writes_during_load[username] += 1
+        if len(self._pending) >= FLUSH_BATCH_SIZE:
+            self._wakeup.set()
+
+    def set_summary(self, username: str, summary: Summary):
+        super().set_summary(username, summary)
+        self._pending_summaries[username] = summary
+        if username in self._writes_during_load:
+            self._writes_during_load[username] += 1
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=FLUSH_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("❌ Conversation flush failed: %s", e)
+
+    async def flush(self):
+        # Serialized so concurrent flushes can't reorder batches
+        async with self._flush_lock:
+            if not (self._pending or self._pending_summaries) or self._conn is None:
+                return
+            batch, self._pending = self._pending, []
+            summaries, self._pending_summaries = self._pending_summaries, {}
+            try:
+                await asyncio.to_thread(self._write, batch, summaries)
+            except Exception:
+                # Put the batch back in front so ordering is preserved on retry
+                self._pending = batch + self._pending
+                for username, summary in summaries.items():
+                    self._pending_summaries.setdefault(username, summary)
+                raise
+
+    def _write(self, batch: list[tuple], summaries: dict[str, Summary]):
+        with self._db_lock:
+            self._conn.executemany(
+                "INSERT INTO conversation_messages (username, role, content, created_at)"
+                " VALUES (?, ?, ?, ?)",
+                batch,
+            )
+            now = time.time()
+            self._conn.executemany(
+                "INSERT INTO conversation_summaries (username, summary, through, updated_at)"
+                " VALUES (?, ?, ?, ?)"
+                " ON CONFLICT (username) DO UPDATE SET"
+                " summary = excluded.summary, through = excluded.through, updated_at = excluded.updated_at",
+                [(username, summary.text, summary.through, now) for username, summary in summaries.items()],
+            )
+            self._conn.commit()
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def create_store(kind: str = CONVERSATION_STORE) -> ConversationStore:
+    if kind == "memory":
+        return MemoryConversationStore()
+    if kind == "sqlite":
+        return SQLiteConversationStore()
+    raise ValueError(f"Unknown CONVERSATION_STORE backend: {kind}")
+
+
+USER_CONTEXT_STORE = create_store()
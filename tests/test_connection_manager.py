@@ -0,0 +1,47 @@
+# tests/test_connection_manager.py
+import asyncio
+
+import connection_manager
+from connection_manager import ConnectionManager
+
+
+class SilentSocket:
+    """Accepts pings but never answers them."""
+
+    def __init__(self):
+        self.closed_with = None
+
+    async def send_json(self, message: dict):
+        pass
+
+    async def close(self, code: int, reason: str):
+        self.closed_with = code
+
+
+def _run_heartbeats(monkeypatch, busy: bool) -> int | None:
+    monkeypatch.setattr(connection_manager, "WS_PING_INTERVAL", 0.02)
+    monkeypatch.setattr(connection_manager, "WS_PONG_TIMEOUT", 0.02)
+
+    async def scenario():
+        manager = ConnectionManager()
+        socket = SilentSocket()
+        conn = manager.register(socket, "alice")
+        if busy:
+            conn.in_flight["r1"] = asyncio.create_task(asyncio.sleep(1))
+        manager.start()
+        await asyncio.sleep(0.2)
+        manager.stop()
+        for task in conn.in_flight.values():
+            task.cancel()
+        manager.unregister(conn)
+        return socket.closed_with
+
+    return asyncio.run(scenario())
+
+
+def test_silent_idle_client_is_reaped(monkeypatch):
+    assert _run_heartbeats(monkeypatch, busy=False) == 1001
+
+
+def test_client_mid_turn_is_not_reaped(monkeypatch):
+    assert _run_heartbeats(monkeypatch, busy=True) is None
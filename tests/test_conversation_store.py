@@ -0,0 +1,139 @@
+# tests/test_conversation_store.py
+import asyncio
+
+import context_manager
+from state_manager import MemoryConversationStore, SQLiteConversationStore, Summary
+
+
+def _turns(store, username: str, count: int, size: int = 40):
+    for i in range(count):
+        store.append(username, {"role": "user" if i % 2 == 0 else "ai", "content": f"m{i} " + "x" * size})
+
+
+def test_reload_restores_seq_and_summary(tmp_path):
+    async def scenario():
+        store = SQLiteConversationStore(path=str(tmp_path / "c.db"))
+        await store.start()
+        await store.load("alice")
+        _turns(store, "alice", 6)
+        store.set_summary("alice", Summary("talked about m0-m3", 4))
+        await store.close()
+
+        # Another worker / a reconnect
+        other = SQLiteConversationStore(path=str(tmp_path / "c.db"), max_messages_per_user=4)
+        await other.start()
+        history = await other.load("alice")
+        other.append("alice", {"role": "user", "content": "m6"})
+        history = other.get("alice")
+        summary = other.get_summary("alice")
+        await other.close()
+        return history, summary
+
+    history, summary = asyncio.run(scenario())
+    assert [m["seq"] for m in history] == [3, 4, 5, 6]
+    assert summary == Summary("talked about m0-m3", 4)
+
+
+def test_evicted_user_is_reloaded_not_emptied(tmp_path):
+    async def scenario():
+        store = SQLiteConversationStore(path=str(tmp_path / "c.db"), max_total_bytes=1000)
+        await store.start()
+        await store.load("alice")
+        _turns(store, "alice", 4)
+        await store.load("bob")
+        _turns(store, "bob", 8)  # pushes alice out of the LRU
+        assert not store.cached("alice")
+        assert store.get("alice") == []
+
+        # A write while evicted must not re-cache a partial history
+        store.append("alice", {"role": "user", "content": "while evicted"})
+        assert not store.cached("alice")
+
+        history = await store.load("alice")
+        await store.close()
+        return history
+
+    history = asyncio.run(scenario())
+    assert [m["content"].split()[0] for m in history] == ["m0", "m1", "m2", "m3", "while"]
+
+
+def test_reconnect_does_not_resummarize(tmp_path, monkeypatch):
+    calls = []
+
+    async def fake_summarize(username, previous_summary, messages, max_words=200):
+        calls.append([m["content"].split()[0] for m in messages])
+        return f"{previous_summary} + {len(messages)} messages"
+
+    monkeypatch.setattr(context_manager, "summarize_history", fake_summarize)
+    monkeypatch.setattr(context_manager, "CONTEXT_TOKEN_BUDGET", 60)
+
+    async def scenario():
+        store = SQLiteConversationStore(path=str(tmp_path / "c.db"))
+        monkeypatch.setattr(context_manager, "USER_CONTEXT_STORE", store)
+        await store.start()
+        await store.load("alice")
+        _turns(store, "alice", 8)
+
+        context_manager.build_context("alice", store.get("alice"))
+        await context_manager._refresh_tasks["alice"]
+
+        # Reconnect: history is reloaded from SQLite as fresh dicts
+        await store.flush()
+        await store.load("alice")
+        context = context_manager.build_context("alice", store.get("alice"))
+        task = context_manager._refresh_tasks.get("alice")
+        if task is not None:
+            await task
+        await store.close()
+        return context
+
+    context = asyncio.run(scenario())
+    assert context_manager._refresh_tasks == {}
+    folded = [name for batch in calls for name in batch]
+    assert folded[:4] == ["m0", "m1", "m2", "m3"]
+    assert len(folded) == len(set(folded))
+    assert context[0]["role"] == "system"
+
+
+def test_append_during_load_is_kept(tmp_path):
+    async def scenario(ticks: int):
+        store = SQLiteConversationStore(path=str(tmp_path / f"c{ticks}.db"))
+        await store.start()
+        await store.load("alice")
+        _turns(store, "alice", 2)
+        await store.flush()
+
+        # A second tab connects while the first tab's turn commits
+        loading = asyncio.create_task(store.load("alice"))
+        for _ in range(ticks):
+            await asyncio.sleep(0)
+        store.append("alice", {"role": "user", "content": "during load"})
+        await loading
+        store.append("alice", {"role": "ai", "content": "after load"})
+        history = store.get("alice")
+        await store.close()
+        return history
+
+    for ticks in range(8):
+        history = asyncio.run(scenario(ticks))
+        assert [m["content"].split()[0] for m in history] == ["m0", "m1", "during", "after"], ticks
+        assert [m["seq"] for m in history] == [0, 1, 2, 3], ticks
+
+
+def test_unsummarized_turns_stay_in_context(monkeypatch):
+    async def failing_summarize(username, previous_summary, messages, max_words=200):
+        raise RuntimeError("upstream down")
+
+    store = MemoryConversationStore()
+    monkeypatch.setattr(context_manager, "summarize_history", failing_summarize)
+    monkeypatch.setattr(context_manager, "CONTEXT_TOKEN_BUDGET", 60)
+    monkeypatch.setattr(context_manager, "USER_CONTEXT_STORE", store)
+
+    async def scenario():
+        _turns(store, "alice", 8)
+        context = context_manager.build_context("alice", store.get("alice"))
+        await context_manager._refresh_tasks["alice"]
+        return context
+
+    context = asyncio.run(scenario())
+    assert [m["content"].split()[0] for m in context] == [f"m{i}" for i in range(8)]
@@ -0,0 +1,74 @@
+# tests/test_model_router.py
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import ai_client
+import model_router
+from ai_client import UpstreamError
+from model_router import ModelRouter, Route
+
+
+def _routes(*names: str) -> list[Route]:
+    return [Route(name=name, url=f"http://{name}", model=name) for name in names]
+
+
+def test_no_hedge_while_route_backs_off(monkeypatch):
+    monkeypatch.setattr(model_router, "ROUTER_HEDGE_DEFAULT_DELAY", 0.05)
+    router = ModelRouter(_routes("primary"))
+    calls = []
+
+    async def attempt(route):
+        calls.append(route.name)
+        router.backing_off(route, 0.2)
+        await asyncio.sleep(0.2)
+        return "ok"
+
+    assert asyncio.run(router.call(10, attempt)) == "ok"
+    assert calls == ["primary"]
+
+
+def test_client_error_does_not_fall_back(monkeypatch):
+    monkeypatch.setattr(model_router, "ROUTER_HEDGE_ENABLED", False)
+    router = ModelRouter(_routes("primary", "backup"))
+    calls = []
+
+    async def attempt(route):
+        calls.append(route.name)
+        raise UpstreamError("bad request", status_code=400)
+
+    with pytest.raises(UpstreamError):
+        asyncio.run(router.call(10, attempt, is_failure=ai_client._is_retryable))
+    assert calls == ["primary"]
+
+
+def test_upstream_failure_falls_back(monkeypatch):
+    monkeypatch.setattr(model_router, "ROUTER_HEDGE_ENABLED", False)
+    router = ModelRouter(_routes("primary", "backup"))
+
+    async def attempt(route):
+        if route.name == "primary":
+            raise UpstreamError("unavailable", status_code=503)
+        return route.name
+
+    assert asyncio.run(router.call(10, attempt, is_failure=ai_client._is_retryable)) == "backup"
+
+
+def test_rate_limited_call_stays_within_max_attempts(monkeypatch):
+    calls = []
+
+    def handler(request):
+        calls.append(time.monotonic())
+        return httpx.Response(429, headers={"Retry-After": "5"}, json={"error": "rate limited"})
+
+    monkeypatch.setenv("GROQ_API_KEY", "test")
+    monkeypatch.setattr(ai_client, "client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(ai_client, "router", ModelRouter(_routes("primary")))
+    monkeypatch.setattr(ai_client, "UPSTREAM_RETRY_AFTER_MAX", 0.2)
+    monkeypatch.setattr(model_router, "ROUTER_HEDGE_DEFAULT_DELAY", 0.05)
+
+    with pytest.raises(UpstreamError):
+        asyncio.run(ai_client._complete("alice", [{"role": "user", "content": "hi"}]))
+    assert len(calls) == ai_client.UPSTREAM_MAX_ATTEMPTS
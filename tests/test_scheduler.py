@@ -0,0 +1,100 @@
+# tests/test_scheduler.py
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import ai_client
+from ai_client import QueueTimeout, UpstreamScheduler
+from model_router import ModelRouter, Route
+
+
+def test_slots_rotate_between_users():
+    scheduler = UpstreamScheduler(max_concurrency=1)
+    order = []
+
+    async def ask(username: str, label: str):
+        async with scheduler.slot(username, timeout=1):
+            order.append(label)
+            await asyncio.sleep(0)
+
+    async def scenario():
+        async with scheduler.slot("holder", timeout=1):
+            tasks = [asyncio.create_task(ask("alice", f"a{i}")) for i in range(3)]
+            await asyncio.sleep(0)
+            tasks.append(asyncio.create_task(ask("bob", "b0")))
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+    assert order == ["a0", "b0", "a1", "a2"]
+    assert scheduler.stats()["in_flight"] == 0
+
+
+def test_waiter_times_out():
+    scheduler = UpstreamScheduler(max_concurrency=1)
+
+    async def scenario():
+        async with scheduler.slot("alice", timeout=1):
+            with pytest.raises(QueueTimeout):
+                await scheduler.acquire("bob", timeout=0.05)
+
+    asyncio.run(scenario())
+    stats = scheduler.stats()
+    assert stats["timed_out"] == 1
+    assert stats["queue_depth"] == 0
+    assert stats["in_flight"] == 0
+
+
+def test_cancelled_waiter_hands_slot_on():
+    scheduler = UpstreamScheduler(max_concurrency=1)
+
+    async def scenario():
+        async with scheduler.slot("alice", timeout=1):
+            gone = asyncio.create_task(scheduler.acquire("bob", timeout=1))
+            staying = asyncio.create_task(scheduler.acquire("carol", timeout=1))
+            await asyncio.sleep(0)
+            gone.cancel()
+            await asyncio.sleep(0)
+        await asyncio.wait_for(staying, timeout=1)
+        assert scheduler.stats()["in_flight"] == 1
+        scheduler.release()
+
+    asyncio.run(scenario())
+    assert scheduler.stats()["in_flight"] == 0
+    assert scheduler.stats()["queue_depth"] == 0
+
+
+def test_backoff_gives_up_the_slot(monkeypatch):
+    rate_limited = []
+
+    def handler(request):
+        question = json.loads(request.content)["messages"][-1]["content"]
+        if question == "from alice" and not rate_limited:
+            rate_limited.append(request)
+            return httpx.Response(429, headers={"Retry-After": "0.3"}, json={"error": "rate limited"})
+        return httpx.Response(200, json={"choices": [{"message": {"content": f"re: {question}"}}]})
+
+    monkeypatch.setenv("GROQ_API_KEY", "test")
+    monkeypatch.setattr(ai_client, "client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(ai_client, "router", ModelRouter([Route(name="primary", url="http://primary", model="m")]))
+    monkeypatch.setattr(ai_client, "scheduler", UpstreamScheduler(max_concurrency=1))
+    monkeypatch.setattr(ai_client, "UPSTREAM_QUEUE_TIMEOUT", 0.2)
+
+    finished = []
+
+    async def ask(username: str):
+        answer = await ai_client._complete(username, [{"role": "user", "content": f"from {username}"}])
+        finished.append(username)
+        return answer
+
+    async def scenario():
+        alice = asyncio.create_task(ask("alice"))
+        await asyncio.sleep(0.05)
+        # Alice is sleeping off her 429; Bob must not wait behind it
+        return await asyncio.gather(alice, ask("bob"))
+
+    assert asyncio.run(scenario()) == ["re: from alice", "re: from bob"]
+    assert finished == ["bob", "alice"]
+    assert ai_client.scheduler.stats()["timed_out"] == 0
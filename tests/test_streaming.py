@@ -0,0 +1,153 @@
+# tests/test_streaming.py
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import ai_client
+import main
+from ai_client import StreamInterrupted
+from state_manager import MemoryConversationStore
+
+
+def _sse(*deltas: str) -> list[bytes]:
+    return [f"data: {json.dumps({'choices': [{'delta': {'content': d}}]})}\n\n".encode() for d in deltas]
+
+
+def _use_upstream(monkeypatch, body):
+    """Points ai_client at a mock transport whose streamed body is `body()` (an async iterator)."""
+    monkeypatch.setenv("GROQ_API_KEY", "test")
+    monkeypatch.setattr(ai_client, "client", httpx.AsyncClient(
+        transport=httpx.MockTransport(lambda request: httpx.Response(200, content=body()))
+    ))
+
+
+async def _collect(**kwargs) -> list[str]:
+    return [c async for c in ai_client.stream_ai_response("alice", [{"role": "user", "content": "hi"}], **kwargs)]
+
+
+def test_stream_failure_after_content_raises(monkeypatch):
+    async def body():
+        for chunk in _sse("Partial answer"):
+            yield chunk
+        raise httpx.ReadError("connection reset")
+
+    _use_upstream(monkeypatch, body)
+    with pytest.raises(StreamInterrupted):
+        asyncio.run(_collect(fresh=True))
+
+
+def test_stream_without_done_is_not_complete(monkeypatch):
+    async def body():
+        for chunk in _sse("Partial", " answer"):
+            yield chunk
+
+    _use_upstream(monkeypatch, body)
+    with pytest.raises(StreamInterrupted):
+        asyncio.run(_collect(fresh=True))
+
+
+def test_completed_stream_yields_deltas(monkeypatch):
+    async def body():
+        for chunk in _sse("Hello", " there") + [b"data: [DONE]\n\n"]:
+            yield chunk
+
+    _use_upstream(monkeypatch, body)
+    assert asyncio.run(_collect(fresh=True)) == ["Hello", " there"]
+
+
+def test_interrupted_turn_is_not_committed(monkeypatch):
+    store = MemoryConversationStore()
+    monkeypatch.setattr(main, "USER_CONTEXT_STORE", store)
+
+    async def broken_stream(username, context_history, knowledge=None, fresh=False):
+        yield "Partial answer"
+        raise StreamInterrupted("AI Error: Connection failed.")
+
+    monkeypatch.setattr(main, "stream_ai_response", broken_stream)
+    sent = []
+
+    async def send(message: dict):
+        sent.append(message)
+
+    async def scenario():
+        commit = main.start_turn({}, send, "alice", "r1", {"data": "q", "stream": True}, None)
+        await asyncio.wait_for(commit, timeout=2)
+        await asyncio.sleep(0)
+
+    outcomes = main.CHAT_TURNS.values
+    before = outcomes.get(("stream", "error"), 0)
+    asyncio.run(scenario())
+
+    assert store.get("alice") == []
+    assert sent[-1]["type"] == "ai_response"
+    assert sent[-1]["data"] == "AI Error: Connection failed."
+    assert outcomes.get(("stream", "error"), 0) == before + 1
+
+
+def test_identical_streams_share_one_upstream_call(monkeypatch):
+    calls = []
+
+    async def body():
+        for chunk in _sse("Hello", " there"):
+            yield chunk
+            await asyncio.sleep(0.05)
+        yield b"data: [DONE]\n\n"
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(200, content=body())
+
+    monkeypatch.setenv("GROQ_API_KEY", "test")
+    monkeypatch.setattr(ai_client, "client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(ai_client, "response_cache", ai_client.ResponseCache())
+
+    async def scenario():
+        first = asyncio.create_task(_collect())
+        await asyncio.sleep(0.07)  # the others join after the first delta went out
+        return await asyncio.gather(first, *(_collect() for _ in range(4)))
+
+    assert asyncio.run(scenario()) == [["Hello", " there"]] * 5
+    assert len(calls) == 1
+    assert ai_client.response_cache.coalesced == 4
+
+
+def test_shared_stream_survives_one_caller_leaving(monkeypatch):
+    async def body():
+        for chunk in _sse("Hello", " there"):
+            yield chunk
+            await asyncio.sleep(0.05)
+        yield b"data: [DONE]\n\n"
+
+    _use_upstream(monkeypatch, body)
+    monkeypatch.setattr(ai_client, "response_cache", ai_client.ResponseCache())
+
+    async def scenario():
+        leaver = asyncio.create_task(_collect())
+        stayer = asyncio.create_task(_collect())
+        await asyncio.sleep(0.02)
+        leaver.cancel()
+        return await stayer
+
+    assert asyncio.run(scenario()) == ["Hello", " there"]
+
+
+def test_request_after_cancel_does_not_join_cancelled_call(monkeypatch):
+    cache = ai_client.ResponseCache()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def scenario():
+        first = asyncio.create_task(cache.get_or_fetch("k", fetch))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        await asyncio.sleep(0)
+        return await cache.get_or_fetch("k", fetch)
+
+    assert asyncio.run(scenario()) == "answer"
+    assert len(calls) == 2
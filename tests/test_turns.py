@@ -0,0 +1,86 @@
+# tests/test_turns.py
+import asyncio
+
+import main
+from state_manager import MemoryConversationStore
+
+
+def _setup(monkeypatch):
+    store = MemoryConversationStore()
+    monkeypatch.setattr(main, "USER_CONTEXT_STORE", store)
+
+    async def fake_response(username, context_history, knowledge=None, fresh=False):
+        await asyncio.sleep(0)
+        return f"answer to {context_history[-1]['content']}"
+
+    monkeypatch.setattr(main, "get_ai_response", fake_response)
+    sent = []
+
+    async def send(message: dict):
+        sent.append(message)
+
+    return store, sent, send
+
+
+def test_cancel_before_start_does_not_block_later_turns(monkeypatch):
+    store, sent, send = _setup(monkeypatch)
+
+    async def scenario():
+        in_flight = {}
+        commit = main.start_turn(in_flight, send, "alice", "r1", {"data": "first"}, None)
+        # Cancelled before run_turn's first step ever runs
+        in_flight["r1"].cancel()
+        for i in range(2, 5):
+            commit = main.start_turn(in_flight, send, "alice", f"r{i}", {"data": f"q{i}"}, commit)
+        await asyncio.wait_for(commit, timeout=2)
+        await asyncio.wait_for(asyncio.gather(*in_flight.values()), timeout=2)
+        return in_flight
+
+    in_flight = asyncio.run(scenario())
+
+    assert in_flight == {}
+    assert [m["request_id"] for m in sent if m["type"] == "ai_response"] == ["r2", "r3", "r4"]
+    assert [m["content"] for m in store.get("alice")] == [
+        "q2", "answer to q2", "q3", "answer to q3", "q4", "answer to q4"
+    ]
+
+
+def test_failed_turn_releases_commit_chain(monkeypatch):
+    store, sent, send = _setup(monkeypatch)
+
+    async def broken(message: dict):
+        raise RuntimeError("socket gone")
+
+    async def scenario():
+        in_flight = {}
+        commit = main.start_turn(in_flight, broken, "bob", "r1", {"data": "first"}, None)
+        commit = main.start_turn(in_flight, send, "bob", "r2", {"data": "second"}, commit)
+        await asyncio.wait_for(commit, timeout=2)
+
+    asyncio.run(scenario())
+    assert [m["request_id"] for m in sent if m["type"] == "ai_response"] == ["r2"]
+
+
+def test_fast_answer_is_not_held_behind_slow_turn(monkeypatch):
+    store, sent, send = _setup(monkeypatch)
+
+    async def uneven_response(username, context_history, knowledge=None, fresh=False):
+        question = context_history[-1]["content"]
+        await asyncio.sleep(0.3 if question == "slow" else 0)
+        return f"answer to {question}"
+
+    monkeypatch.setattr(main, "get_ai_response", uneven_response)
+
+    async def scenario():
+        in_flight = {}
+        commit = main.start_turn(in_flight, send, "carol", "r1", {"data": "slow"}, None)
+        commit = main.start_turn(in_flight, send, "carol", "r2", {"data": "fast"}, commit)
+        await asyncio.sleep(0.1)
+        early = [m["request_id"] for m in sent if m["type"] == "ai_response"]
+        await asyncio.wait_for(commit, timeout=2)
+        return early
+
+    assert asyncio.run(scenario()) == ["r2"]
+    assert [m["content"] for m in store.get("carol")] == [
+        "slow", "answer to slow", "fast", "answer to fast"
+    ]
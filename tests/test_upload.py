@@ -0,0 +1,17 @@
+# tests/test_upload.py
+from fastapi.testclient import TestClient
+
+import main
+
+
+def test_oversized_upload_is_rejected(monkeypatch):
+    def forbidden(username, content):
+        raise AssertionError("oversized text must not be indexed")
+
+    monkeypatch.setattr(main, "add_document", forbidden)
+    monkeypatch.setitem(main.app.dependency_overrides, main.get_current_user_from_header, lambda: "alice")
+
+    response = TestClient(main.app).post(
+        "/api/v1/essays/upload-text", json={"content": "word " * main.UPLOAD_MAX_CHARS}
+    )
+    assert response.status_code == 422
@@ -0,0 +1,39 @@
+# user_cache.py
+import os
+from typing import NamedTuple
+from cachetools import TTLCache
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import User
+
+# Users are only written by other processes (initial_setup.py and other scripts), which
+# can't reach this per-worker cache: a password change or deactivation takes up to
+# USER_CACHE_TTL seconds to reach login. That bound is the only freshness guarantee.
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "30"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+
+
+class CachedUser(NamedTuple):
+    """Detached copy of the User columns login needs (safe to share across sessions)."""
+    username: str
+    hashed_password: str
+    is_active: bool
+
+
+_users: TTLCache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+
+async def get_user(db: AsyncSession, username: str) -> CachedUser | None:
+    """Looks a user up by username, serving repeat lookups from the cache."""
+    user = _users.get(username)
+    if user is not None:
+        return user
+
+    row = (await db.execute(select(User).where(User.username == username))).scalars().first()
+    if row is None:
+        # Unknown users aren't cached, so a newly added account can log in immediately
+        return None
+    user = CachedUser(row.username, row.hashed_password, row.is_active)
+    _users[username] = user
+    return user
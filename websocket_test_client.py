@@ -30,8 +30,13 @@ async def test_websocket_connection(token: str = None, test_name: str = "Test"):
 
             for i, question in enumerate(test_messages, 1):
                 await websocket.send(json.dumps({"data": question}))
-                response = await asyncio.wait_for(websocket.recv(), timeout=20)
-                parsed = json.loads(response)
+                while True:
+                    response = await asyncio.wait_for(websocket.recv(), timeout=20)
+                    parsed = json.loads(response)
+                    # Answer server heartbeats and keep waiting for the reply
+                    if parsed.get("type") != "ping":
+                        break
+                    await websocket.send(json.dumps({"type": "pong"}))
                 
                 # Check for the new structured log format
                 print(f"[{i}] [{parsed.get('timestamp')}] AI Response: {parsed.get('data')}")